@@ -5,11 +5,16 @@ news-picker の chat_agent で実証済みの設計:
 - ツールの失敗は {"error": ...} をツール結果としてモデルに返し、ループは止めない。
 - ツールターンで content が先に流れてしまった場合は turn_reset で UI に破棄させる。
 - 出典 URL の列挙は system prompt で強制する（構造化はしない）。
+- 1ターンに複数のツール呼び出しがあれば並行に実行し、結果は呼び出し順にモデルへ返す。
 """
 from __future__ import annotations
 
 import json
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 
 import llm_client
 import search_web
@@ -18,6 +23,25 @@ logger = logging.getLogger(__name__)
 
 MAX_TOOL_STEPS = 8
 MAX_TOKENS_PER_TURN = 4096
+# 1ターン内のツール呼び出しを並行に実行する上限（検索・Yahoo 取得は待ち時間が大半）
+MAX_PARALLEL_TOOLS = 4
+
+# stock_snapshot の結果をプロセス内で短時間使い回す（同じ会話・続く質問で同一銘柄を
+# 何度も調べても Yahoo へ取り直さない）。株価は動くため保持は数分に留める。
+SNAPSHOT_TTL_SECONDS = 300
+SNAPSHOT_CACHE_SIZE = 64
+_snapshot_cache: dict[str, tuple[float, dict]] = {}  # ticker -> (取得時刻 monotonic, 結果)
+_snapshot_inflight: dict[str, Future] = {}  # ticker -> 取得中の結果
+_snapshot_lock = threading.Lock()
+
+# web_search / news_search の結果も同様に使い回す（エージェントは同じ会話の続く質問で
+# 同じクエリを再検索しがちで、1回ごとに DuckDuckGo への往復とレート制限のリスクがある）。
+# 0 件（失敗・レート制限を含む）は保持しない。news_search は最新の報道を探すためのツールなので
+# 保持を短くし、続報が出ていれば数分で拾えるようにする。
+SEARCH_TTL_SECONDS = {"web_search": 600, "news_search": 120}
+SEARCH_CACHE_SIZE = 128
+_search_cache: dict[tuple[str, str], tuple[float, list[dict]]] = {}  # (ツール名, クエリ) -> (取得時刻, 結果)
+_search_lock = threading.Lock()
 
 AGENT_SYSTEM_PROMPT = """あなたは株式投資の調査アシスタントです。必要に応じてツールを使って回答します。
 
@@ -78,31 +102,117 @@ TOOLS = [
 ]
 
 
-def _stock_snapshot(ticker: str) -> dict:
+def _build_stock_snapshot(symbol: str) -> dict:
     """fetch_review のスナップショットからチャット向けの要約を作る（ニュース・財務表は除く）。"""
     import fetch_review
 
-    payload = fetch_review.build_payload(str(ticker or "").strip())
+    # 画面で直前に開いた銘柄は保存済みスナップショットをそのまま使い、Yahoo へ取り直さない
+    payload = fetch_review.load_fresh_snapshot(
+        symbol, timedelta(seconds=SNAPSHOT_TTL_SECONDS)
+    ) or fetch_review.build_payload(symbol)
+    # 結果はそのままプロンプトに入るため、Yahoo に値が無い項目（None・空文字）は落としてトークンを減らす。
+    # 0 は実際の値（FCF 0 など）なので残す
     return {
         "ticker": payload.get("ticker"),
         "name": payload.get("name"),
         "currency": payload.get("currency"),
-        "overview": payload.get("overview"),
-        "valuation": payload.get("valuation"),
-        "profitability": payload.get("profitability"),
-        "analyst": payload.get("analyst"),
+        **{
+            section: _drop_missing(payload.get(section))
+            for section in ("overview", "valuation", "profitability", "analyst")
+        },
     }
 
 
+def _drop_missing(values):
+    if not isinstance(values, dict):
+        return values
+    return {key: value for key, value in values.items() if value is not None and value != ""}
+
+
+def _stock_snapshot(ticker: str) -> dict:
+    symbol = str(ticker or "").strip()
+    now = time.monotonic()
+    with _snapshot_lock:
+        cached = _snapshot_cache.get(symbol)
+        if cached and now - cached[0] < SNAPSHOT_TTL_SECONDS:
+            return cached[1]
+        # 同じ銘柄を取得中なら（並行ツール実行・別セッション）その結果を待って共有する
+        pending = _snapshot_inflight.get(symbol)
+        if pending is None:
+            future = _snapshot_inflight[symbol] = Future()
+    if pending is not None:
+        return pending.result()
+
+    try:
+        result = _build_stock_snapshot(symbol)
+    except BaseException as exc:
+        with _snapshot_lock:
+            _snapshot_inflight.pop(symbol, None)
+        future.set_exception(exc)
+        raise
+    with _snapshot_lock:
+        _snapshot_inflight.pop(symbol, None)
+        _snapshot_cache[symbol] = (time.monotonic(), result)
+        if len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+            oldest = min(_snapshot_cache, key=lambda key: _snapshot_cache[key][0])
+            del _snapshot_cache[oldest]
+    future.set_result(result)
+    return result
+
+
+def _query_arg(args: dict) -> str:
+    return str(args.get("query") or "").strip()
+
+
+def _cached_search(tool: str, query: str, search) -> list[dict]:
+    key = (tool, query)
+    now = time.monotonic()
+    with _search_lock:
+        cached = _search_cache.get(key)
+    if cached and now - cached[0] < SEARCH_TTL_SECONDS[tool]:
+        return cached[1]
+
+    results = search(query, max_results=8)
+    if results:
+        with _search_lock:
+            _search_cache[key] = (time.monotonic(), results)
+            if len(_search_cache) > SEARCH_CACHE_SIZE:
+                oldest = min(_search_cache, key=lambda k: _search_cache[k][0])
+                del _search_cache[oldest]
+    return results
+
+
+# ツール名 -> 実行関数。ツールの集合は TOOLS と同じく固定なので、名前の比較を
+# 順に並べず表を1回引くだけにする（各ツールは自分の使う引数だけを取り出す）。
+_TOOL_HANDLERS = {
+    "web_search": lambda args: _cached_search("web_search", _query_arg(args), search_web.search_text),
+    "news_search": lambda args: _cached_search("news_search", _query_arg(args), search_web.search_news),
+    "stock_snapshot": lambda args: _stock_snapshot(str(args.get("ticker") or "")),
+}
+
+
 def _dispatch_tool(name: str, args: dict):
-    query = str(args.get("query") or "").strip()
-    if name == "web_search":
-        return search_web.search_text(query, max_results=8)
-    if name == "news_search":
-        return search_web.search_news(query, max_results=8)
-    if name == "stock_snapshot":
-        return _stock_snapshot(str(args.get("ticker") or ""))
-    return {"error": f"unknown tool: {name}"}
+    handler = _TOOL_HANDLERS.get(name)
+    if handler is None:
+        return {"error": f"unknown tool: {name}"}
+    return handler(args)
+
+
+def _run_tool(call: tuple[str, dict]):
+    name, args = call
+    try:
+        return _dispatch_tool(name, args)
+    except Exception as e:  # ツール失敗でループを止めず、モデルに伝える
+        logger.warning("tool %s failed: %s", name, e)
+        return {"error": str(e)[:200]}
+
+
+def _run_tools(calls: list[tuple[str, dict]]) -> list:
+    """ツール呼び出しを実行し、結果を呼び出し順に返す。複数あれば並行に実行する。"""
+    if len(calls) == 1:
+        return [_run_tool(calls[0])]
+    with ThreadPoolExecutor(max_workers=min(len(calls), MAX_PARALLEL_TOOLS)) as pool:
+        return list(pool.map(_run_tool, calls))
 
 
 def _merge_generation_metrics(total: dict, current: dict | None) -> None:
@@ -145,7 +255,9 @@ def run_chat_agent(llm_messages: list[dict], *, base_url: str):
                 content_parts.append(data)
                 yield {"type": "token", "content": data}
             elif kind == "reasoning":
+                # 思考は長くなりがちなので、ターン終了を待たずに断片のまま UI へ流す
                 reasoning_parts.append(data)
+                yield {"type": "thinking_delta", "content": data}
             elif kind == "tool_calls":
                 tool_calls = data
             elif kind == "metrics":
@@ -164,25 +276,26 @@ def run_chat_agent(llm_messages: list[dict], *, base_url: str):
             yield {"type": "turn_reset"}
 
         msgs.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+        calls: list[tuple[str, dict]] = []
         for tc in tool_calls:
             name = tc.get("function", {}).get("name", "")
             try:
                 args = json.loads(tc.get("function", {}).get("arguments") or "{}")
             except json.JSONDecodeError:
                 args = {}
+            calls.append((name, args))
             yield {"type": "tool_call", "name": name, "args": args}
-            try:
-                result = _dispatch_tool(name, args)
-            except Exception as e:  # ツール失敗でループを止めず、モデルに伝える
-                logger.warning("tool %s failed: %s", name, e)
-                result = {"error": str(e)[:200]}
+
+        # tool_result は tool_call と同じ順に流す（UI は未完了の行へ先頭から結果を付ける）
+        for tc, (name, _args), result in zip(tool_calls, calls, _run_tools(calls)):
             count = len(result) if isinstance(result, list) else None
             yield {"type": "tool_result", "name": name, "count": count}
+            # ツール結果はそのままプロンプトに入るため、区切りの空白を省いて prefill のトークンを減らす
             msgs.append(
                 {
                     "role": "tool",
                     "tool_call_id": tc.get("id", ""),
-                    "content": json.dumps(result, ensure_ascii=False),
+                    "content": json.dumps(result, ensure_ascii=False, separators=(",", ":")),
                 }
             )
 
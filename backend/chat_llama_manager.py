@@ -8,17 +8,16 @@
 """
 from __future__ import annotations
 
-import json
+import http.client
 import logging
 import re
-import socket
 import subprocess
 import sys
+import threading
 import time
 from pathlib import Path
-from urllib import request as urllib_request
 
-from shared import atomic_write_text
+from shared import atomic_write_text, dumps_json, loads_json
 from paths import LLAMA_PATHS_FILE as _PATHS_FILE
 
 logger = logging.getLogger(__name__)
@@ -27,6 +26,7 @@ _ROOT = Path(__file__).resolve().parent.parent
 # Downloaded llama-server builds live under runtime/; bin/ is the legacy location.
 _RUNTIME_DIR = _ROOT / "runtime" / "llama-server"
 _LEGACY_BIN_DIR = _ROOT / "bin" / "llama-server"
+_BUILD_NUMBER = re.compile(r"b(\d+)")
 
 # 注意: news-picker が同一マシンで 8081/8082 を使うため、衝突しないポートを選ぶこと
 PORT = 8091
@@ -34,11 +34,29 @@ DEFAULT_CTX = 16384
 
 CTX_OPTIONS = (4096, 8192, 16384, 32768, 65536)
 
+# KV キャッシュの量子化（--cache-type-k / --cache-type-v）。重みは GGUF 側で量子化済みなので、
+# 実行時に選べるのはこちら。q8_0 で KV のメモリと帯域がほぼ半分になり、長いコンテキストほど効く。
+CACHE_TYPE_OPTIONS = ("f16", "q8_0", "q4_0")
+DEFAULT_CACHE_TYPE = "f16"
+# --flash-attn が on/off/auto の値を取るようになったビルド。これより前と分かっているビルドだけは
+# 値を取らないスイッチで、"on" を渡すと不明な引数として起動に失敗する（番号不明は現行の書式で渡す）
+FLASH_ATTN_VALUE_MIN_BUILD = 6325
+
+# プロンプトの途中（毎ターン変わる RAG コンテキスト）が変わっても、後ろに続く会話履歴の KV を
+# シフトして再利用する最小チャンク長（トークン）。cache_prompt と組み合わせて prefill を減らす。
+CACHE_REUSE_TOKENS = 256
+
 
 def base_url() -> str:
     return f"http://127.0.0.1:{PORT}"
 
 
+def _build_number(name: str) -> int:
+    """ビルドのディレクトリ名（例: llama-b6500-bin-win-cuda-x64）からビルド番号を取り出す。不明なら 0。"""
+    match = _BUILD_NUMBER.search(name)
+    return int(match.group(1)) if match else 0
+
+
 def _find_latest_exe() -> Path:
     builds = [
         child
@@ -47,10 +65,7 @@ def _find_latest_exe() -> Path:
         for child in base.iterdir()
         if child.is_dir() and (child / "llama-server.exe").exists()
     ]
-    builds.sort(
-        key=lambda d: int(m.group(1)) if (m := re.search(r"b(\d+)", d.name)) else 0,
-        reverse=True,
-    )
+    builds.sort(key=lambda d: _build_number(d.name), reverse=True)
     if not builds:
         raise RuntimeError("No llama-server builds found in runtime/llama-server/")
     return builds[0] / "llama-server.exe"
@@ -59,7 +74,8 @@ def _find_latest_exe() -> Path:
 def _get_paths() -> dict:
     if _PATHS_FILE.exists():
         try:
-            return json.loads(_PATHS_FILE.read_text("utf-8-sig"))
+            # バイト列のまま解析する（BOM 付き UTF-8 も loads_json 側で読める）
+            return loads_json(_PATHS_FILE.read_bytes())
         except Exception:
             pass
     return {}
@@ -67,7 +83,7 @@ def _get_paths() -> dict:
 
 def _save_paths(paths: dict) -> None:
     _PATHS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    atomic_write_text(_PATHS_FILE, json.dumps(paths, indent=2, ensure_ascii=False))
+    atomic_write_text(_PATHS_FILE, dumps_json(paths, indent=True))
 
 
 def _server_state(paths: dict) -> dict:
@@ -129,6 +145,7 @@ def migrate_legacy_state() -> None:
 def _kill_pid(pid) -> None:
     if not pid:
         return
+    _forget_ready()
     if sys.platform == "win32":
         result = subprocess.run(
             ["taskkill", "/F", "/T", "/PID", str(pid)],
@@ -143,20 +160,47 @@ def _kill_pid(pid) -> None:
             pass
 
 
+# 稼働確認が成功した結果を使い回す秒数。チャット・状態表示のたびに TCP 接続 + /health の
+# 往復をしないようにする。停止・再起動（_kill_pid）で即座に破棄する。
+_READY_CACHE_SECONDS = 3.0
+# この時刻（time.monotonic）までは稼働中とみなす。float の代入は GIL 下で原子的なのでロック不要
+_ready_until = 0.0
+
+
+# 起動待ち（_wait_for_server）の中止要求。stop() / stop_all()（サーバー終了時）で立て、
+# ロード中のモデルを待ち続けずに start() を抜けさせる。start() が新しく起動するたびに下ろす。
+_stop_requested = threading.Event()
+
+
+def _forget_ready() -> None:
+    global _ready_until
+    _ready_until = 0.0
+
+
 def is_ready() -> bool:
-    # まず素の TCP 接続で待ち受けの有無を確認する。Windows では待ち受けの無い
-    # ポートへの SYN が拒否（RST）されずに破棄されることがあり、いきなり HTTP
-    # プローブするとサーバー停止中は毎回タイムアウト（2秒）まで待たされるため。
-    try:
-        with socket.create_connection(("127.0.0.1", PORT), timeout=0.3):
-            pass
-    except OSError:
-        return False
+    global _ready_until
+    if time.monotonic() < _ready_until:
+        return True
+    # まず短いタイムアウトで TCP 接続だけを張り、待ち受けの有無を確認する。Windows では
+    # 待ち受けの無いポートへの SYN が拒否（RST）されずに破棄されることがあり、いきなり
+    # HTTP プローブするとサーバー停止中は毎回タイムアウト（2秒）まで待たされるため。
+    # 接続できたら同じ接続のまま /health を問い合わせる（2回目の接続を張らない）。
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=0.3)
     try:
-        with urllib_request.urlopen(f"{base_url()}/health", timeout=2) as resp:
-            return resp.status == 200
+        try:
+            conn.connect()
+        except OSError:
+            return False
+        conn.sock.settimeout(2)
+        conn.request("GET", "/health")
+        ready = conn.getresponse().status == 200
     except Exception:
         return False
+    finally:
+        conn.close()
+    if ready:
+        _ready_until = time.monotonic() + _READY_CACHE_SECONDS
+    return ready
 
 
 def get_status() -> dict:
@@ -169,44 +213,64 @@ def get_status() -> dict:
         "model_path": model_path,
         "model_name": Path(model_path).name if model_path else "",
         "ctx_size": int(state.get("ctx_size") or DEFAULT_CTX),
+        "cache_type": state.get("cache_type") or DEFAULT_CACHE_TYPE,
     }
 
 
-def save_settings(model_path: str | None = None, ctx_size: int | None = None) -> None:
+def save_settings(model_path: str | None = None, ctx_size: int | None = None,
+                  cache_type: str | None = None) -> None:
     paths = _get_paths()
     state = _server_state(paths)
     if model_path is not None:
         state["model_path"] = model_path
     if ctx_size is not None:
         state["ctx_size"] = int(ctx_size)
+    if cache_type is not None:
+        state["cache_type"] = cache_type
     _save_paths(paths)
 
 
-def _wait_for_server(timeout: int = 120) -> None:
-    deadline = time.time() + timeout
-    while time.time() < deadline:
+def _wait_for_server(proc: subprocess.Popen | None = None, timeout: int = 120) -> None:
+    """サーバーが応答するまで待つ。proc を渡すと、ロード中にプロセスが落ちた時点
+    （VRAM 不足・非対応オプションなど）でタイムアウトを待たずに失敗を返す。
+    待っている間に stop() が呼ばれたら、起動中のプロセスを止めて中止する。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
         if is_ready():
             return
-        time.sleep(1.5)
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"llama-server exited during startup (exit code {proc.returncode})")
+        if _stop_requested.wait(1.5):
+            # pid の保存前に stop() が来た場合は stop() 側で止められないため、ここでも止める
+            if proc is not None and proc.poll() is None:
+                _kill_pid(proc.pid)
+            raise RuntimeError("llama-server の起動を中止しました")
     raise TimeoutError("llama-server did not start within the timeout")
 
 
 def start(model_path: str | None = None, ctx_size: int | None = None,
-          n_gpu_layers: int = -1) -> None:
-    """サーバーを起動する。既に同じモデル・同じ ctx で起動済みなら何もしない。"""
+          n_gpu_layers: int = -1, cache_type: str | None = None) -> None:
+    """サーバーを起動する。既に同じモデル・同じ ctx・同じ KV キャッシュ型で起動済みなら何もしない。"""
     paths = _get_paths()
     state = _server_state(paths)
     target_path = model_path or state.get("model_path", "")
     if not target_path:
         raise ValueError("モデルが設定されていません")
     target_ctx = int(ctx_size or state.get("ctx_size") or DEFAULT_CTX)
-
-    if is_ready() and state.get("model_path") == target_path and int(state.get("ctx_size") or 0) == target_ctx:
+    target_cache_type = cache_type or state.get("cache_type") or DEFAULT_CACHE_TYPE
+
+    if (
+        is_ready()
+        and state.get("model_path") == target_path
+        and int(state.get("ctx_size") or 0) == target_ctx
+        and (state.get("cache_type") or DEFAULT_CACHE_TYPE) == target_cache_type
+    ):
         logger.info("llama-server already running: %s", Path(target_path).name)
         return
 
     stop()
     time.sleep(1)
+    _stop_requested.clear()
 
     exe = _find_latest_exe()
     model_p = Path(target_path)
@@ -225,9 +289,23 @@ def start(model_path: str | None = None, ctx_size: int | None = None,
         # チャットテンプレートによるツールコール解析と reasoning_content の分離に必須
         "--jinja",
         "--alias", model_p.stem,
+        # スロット数と KV の共有（--parallel / --kv-unified）は指定せず llama-server の既定に任せる。
+        # 近年のビルドは既定で複数スロット＋スロット間共有の KV になっており、古いビルド（旧 bin/ 配下）は
+        # --kv-unified を知らず起動に失敗するため
+        "--cache-reuse", str(CACHE_REUSE_TOKENS),
     ]
     if mmproj_candidates:
         cmd += ["--mmproj", str(mmproj_candidates[0])]
+    if target_cache_type != DEFAULT_CACHE_TYPE:
+        # V キャッシュの量子化は Flash Attention が前提。auto のままだと環境によって無効になり
+        # 起動に失敗するため明示的に有効にする（f16 のときは llama-server の判定に任せる）。
+        # 古いビルドの --flash-attn は値を取らないので、ビルド番号で書式を選ぶ
+        build = _build_number(exe.parent.name)
+        if 0 < build < FLASH_ATTN_VALUE_MIN_BUILD:
+            cmd += ["--flash-attn"]
+        else:
+            cmd += ["--flash-attn", "on"]
+        cmd += ["--cache-type-k", target_cache_type, "--cache-type-v", target_cache_type]
 
     kwargs: dict = {}
     if sys.platform == "win32":
@@ -243,14 +321,17 @@ def start(model_path: str | None = None, ctx_size: int | None = None,
     state = _server_state(paths)
     state["model_path"] = str(model_p)
     state["ctx_size"] = target_ctx
+    state["cache_type"] = target_cache_type
     state["pid"] = proc.pid
     _save_paths(paths)
 
-    _wait_for_server()
+    _wait_for_server(proc)
     logger.info("llama-server ready: %s", model_p.name)
 
 
 def stop() -> None:
+    _stop_requested.set()
+    _forget_ready()
     paths = _get_paths()
     state = _server_state(paths)
     pid = state.get("pid")
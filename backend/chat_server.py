@@ -6,8 +6,10 @@ import importlib
 import json
 import logging
 import os
+import re
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -23,9 +25,6 @@ import chat_store as store
 import chat_llama_manager as llama
 import chat_agent
 import llm_client
-import llama_updater
-import embed_manager
-import fetch_margin
 import market_news
 from chat_embedder import warmup as embed_warmup
 
@@ -38,10 +37,14 @@ MODELS_DIR = _ROOT / "models"
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    store.init_db()
-    llama.migrate_legacy_state()
     loop = asyncio.get_event_loop()
     loop.run_in_executor(None, embed_warmup)
+    # chat.db のスキーマ確認と llama 設定の移行（旧サーバーの停止・疎通確認を含む）は
+    # 互いに独立なので並行に済ませ、起動待ちを長い方の時間だけにする。
+    await asyncio.gather(
+        asyncio.to_thread(store.init_db),
+        asyncio.to_thread(llama.migrate_legacy_state),
+    )
     yield
     try:
         llama.stop_all()
@@ -63,6 +66,17 @@ app.add_middleware(
 # 書き込み系リクエスト自体は止められないため、全リクエストで検証する。
 API_TOKEN = os.environ.get("STOCK_REVIEW_API_TOKEN", "")
 
+# チャット系ストリームの共通レスポンスヘッダー（プロキシ・ブラウザにバッファさせない）
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# token イベントは応答1回で数百〜数千回送るため、固定部分は組み立て済みの文字列を使い本文だけを JSON にする
+# （json.dumps({"type": "token", "content": ...}) と同じ出力）
+_TOKEN_FRAME_PREFIX = 'data: {"type": "token", "content": '
+
+
+def _token_frame(content: str) -> str:
+    return _TOKEN_FRAME_PREFIX + json.dumps(content, ensure_ascii=False) + "}\n\n"
+
 
 @app.middleware("http")
 async def _require_api_token(request: Request, call_next):
@@ -164,6 +178,16 @@ def system_install_deps():
 
 # ── Model management ──────────────────────────────────────
 
+# ファイル名に付く量子化タグ（Qwen3-8B-Q4_K_M.gguf の Q4_K_M など）。
+# デコードは重みの読み出し帯域で律速されるため、一覧で 4bit / 8bit を見分けられるようにする
+_GGUF_QUANT = re.compile(r"(?:^|[-_.])((?:I?Q\d+(?:_[A-Z0-9]+)*)|BF16|F16|F32)(?=[-_.]|$)", re.IGNORECASE)
+
+
+def _gguf_quant(filename: str) -> str:
+    matches = _GGUF_QUANT.findall(Path(filename).stem)
+    return matches[-1].upper() if matches else ""
+
+
 def _find_gguf_files() -> list[dict]:
     results = []
     for p in MODELS_DIR.rglob("*.gguf"):
@@ -172,6 +196,8 @@ def _find_gguf_files() -> list[dict]:
                 "name": p.name,
                 "path": str(p),
                 "relative_path": str(p.relative_to(MODELS_DIR)),
+                "quant": _gguf_quant(p.name),
+                "size_bytes": p.stat().st_size,
             })
     return results
 
@@ -180,11 +206,13 @@ class LlamaStartRequest(BaseModel):
     model_path: str | None = None
     ctx_size: int | None = None
     n_gpu_layers: int = -1
+    cache_type: str | None = None
 
 
 class LlamaSettingsRequest(BaseModel):
     model_path: str | None = None
     ctx_size: int | None = None
+    cache_type: str | None = None
 
 
 def _validate_ctx_size(ctx_size: int | None) -> int | None:
@@ -195,6 +223,14 @@ def _validate_ctx_size(ctx_size: int | None) -> int | None:
     return ctx_size
 
 
+def _validate_cache_type(cache_type: str | None) -> str | None:
+    if cache_type is None:
+        return None
+    if cache_type not in llama.CACHE_TYPE_OPTIONS:
+        raise HTTPException(400, f"cache_type must be one of {list(llama.CACHE_TYPE_OPTIONS)}")
+    return cache_type
+
+
 @app.get("/models")
 def get_models():
     return _find_gguf_files()
@@ -209,7 +245,11 @@ def llama_status():
 async def llama_start(req: LlamaStartRequest):
     try:
         await asyncio.to_thread(
-            llama.start, req.model_path, _validate_ctx_size(req.ctx_size), req.n_gpu_layers
+            llama.start,
+            req.model_path,
+            _validate_ctx_size(req.ctx_size),
+            req.n_gpu_layers,
+            _validate_cache_type(req.cache_type),
         )
         return llama.get_status()
     except HTTPException:
@@ -226,7 +266,9 @@ async def llama_stop():
 
 @app.put("/llama/settings")
 def llama_settings(req: LlamaSettingsRequest):
-    llama.save_settings(req.model_path, _validate_ctx_size(req.ctx_size))
+    llama.save_settings(
+        req.model_path, _validate_ctx_size(req.ctx_size), _validate_cache_type(req.cache_type)
+    )
     return llama.get_status()
 
 
@@ -238,11 +280,15 @@ class LlamaDownloadRequest(BaseModel):
 
 @app.get("/llama/local-status")
 def llama_local_status():
+    import llama_updater  # 設定画面でのみ使うため遅延 import（サーバー起動を軽くする）
+
     return llama_updater.get_local_status()
 
 
 @app.get("/llama/releases/latest")
 async def llama_latest_release():
+    import llama_updater
+
     try:
         return await asyncio.to_thread(llama_updater.fetch_latest_release)
     except Exception as e:
@@ -251,6 +297,8 @@ async def llama_latest_release():
 
 @app.post("/llama/download")
 def llama_download(req: LlamaDownloadRequest):
+    import llama_updater
+
     def event_stream():
         try:
             for event in llama_updater.download_build(req.asset_name):
@@ -265,11 +313,15 @@ def llama_download(req: LlamaDownloadRequest):
 
 @app.get("/embedding/status")
 def embedding_status():
+    import embed_manager  # 設定画面でのみ使うため遅延 import
+
     return embed_manager.get_status()
 
 
 @app.post("/embedding/download")
 def embedding_download():
+    import embed_manager
+
     def event_stream():
         try:
             for event in embed_manager.download():
@@ -282,6 +334,8 @@ def embedding_download():
 
 @app.post("/embedding/install-deps")
 def embedding_install_deps():
+    import embed_manager
+
     def event_stream():
         try:
             for event in embed_manager.install_deps():
@@ -300,11 +354,15 @@ class MarginSettingsBody(BaseModel):
 
 @app.get("/margin/settings")
 def margin_settings():
+    import fetch_margin  # 設定画面でしか使わないため遅延 import
+
     return fetch_margin.get_settings()
 
 
 @app.put("/margin/settings")
 def margin_settings_update(body: MarginSettingsBody):
+    import fetch_margin
+
     return fetch_margin.save_settings(body.autoIngest)
 
 
@@ -574,14 +632,7 @@ async def market_summary():
     if not items:
         raise HTTPException(404, "ニュースを取得できていません。先にニュースを更新してください。")
 
-    lines = []
-    for item in items:
-        date = str(item.get("date") or "")[:10]
-        source = str(item.get("source") or "")
-        meta = "・".join(part for part in (source, date) if part)
-        snippet = str(item.get("snippet") or "")[:80]
-        lines.append(f"- {item.get('title')}{f'（{meta}）' if meta else ''} {snippet}".rstrip())
-    user_content = "最近のマーケットニュース:\n" + "\n".join(lines)
+    user_content = "最近のマーケットニュース:\n" + market_news.headline_digest(news)
     llm_messages = [
         {"role": "system", "content": MARKET_SUMMARY_SYSTEM},
         {"role": "user", "content": user_content},
@@ -593,7 +644,7 @@ async def market_summary():
                 base_url, llm_messages, max_tokens=2048, enable_thinking=False
             ):
                 if kind == "content":
-                    yield f"data: {json.dumps({'type': 'token', 'content': data}, ensure_ascii=False)}\n\n"
+                    yield _token_frame(data)
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
             return
@@ -602,7 +653,7 @@ async def market_summary():
     return StreamingResponse(
         generate(),
         media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        headers=SSE_HEADERS,
     )
 
 
@@ -621,6 +672,33 @@ class ChatRequest(BaseModel):
     system_prompt: str | None = None
 
 
+# 会話記憶の保存は埋め込み計算を含み時間がかかるため、done を返した後に裏で行う。
+# ワーカーは1本にして chat.db への記憶の書き込みを直列に保つ
+# （記憶検索は現在の会話を除外するので、保存の完了を次のターンが待つ必要はない）。
+_memory_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+
+
+def _save_turn_memory_later(session_id: int, user_content: str, assistant_content: str) -> None:
+    def run():
+        try:
+            store.save_turn_memory(session_id, user_content, assistant_content)
+        except Exception as e:
+            logger.warning("save_turn_memory failed: %s", e)
+
+    _memory_writer.submit(run)
+
+
+async def _persist_user_message(session_id: int, user_content: str) -> dict | None:
+    """ユーザー発言を保存する。セッション最初の発言ならその冒頭をタイトルにする。"""
+    if not user_content:
+        return None
+    is_first = not await asyncio.to_thread(store.has_messages, session_id)
+    user_message = await asyncio.to_thread(store.append_message, session_id, "user", user_content)
+    if is_first:
+        await asyncio.to_thread(store.rename_session, session_id, user_content[:28].strip())
+    return user_message
+
+
 @app.post("/chat/stream")
 async def chat_stream(req: ChatRequest):
     """ツール無しの単発ストリーム（銘柄ノート要約などの背景処理用）。
@@ -633,56 +711,46 @@ async def chat_stream(req: ChatRequest):
 
     messages = [{"role": m.role, "content": m.content} for m in req.messages]
     user_content = messages[-1]["content"] if messages and messages[-1]["role"] == "user" else ""
-    context = ""
-    if user_content:
-        context = await asyncio.to_thread(
-            store.build_combined_context,
-            req.session_id,
-            user_content,
-        )
-    # system メッセージは1つに結合（Qwen3 系は複数で 400）
-    system_parts = [part for part in (req.system_prompt or "", context) if part]
-    llm_messages = messages
-    if system_parts:
-        llm_messages = [{"role": "system", "content": "\n\n".join(system_parts)}, *messages]
-
-    # Persist user message and auto-title on first turn
-    user_message = None
-    if user_content and req.persist_user:
-        existing = await asyncio.to_thread(store.list_messages, req.session_id)
-        is_first = len(existing) == 0
-        user_message = await asyncio.to_thread(store.append_message, req.session_id, "user", user_content)
-        if is_first:
-            await asyncio.to_thread(store.rename_session, req.session_id, user_content[:28].strip())
+    user_message = await _persist_user_message(req.session_id, user_content) if req.persist_user else None
 
     def generate():
-        accumulated = ""
+        # 断片はリストに溜めて最後に一度だけ連結する（str の += は断片ごとに全体をコピーし直す）
+        content_parts: list[str] = []
         generation_metrics = {}
         try:
+            # 記憶・資料の検索（埋め込み計算を含む）は /chat/agent-stream と同じくストリーム開始後に行い、
+            # 応答ヘッダーを検索の完了を待たずに返す
+            context = store.build_combined_context(req.session_id, user_content) if user_content else ""
+            # system メッセージは1つに結合（Qwen3 系は複数で 400）
+            system_parts = [part for part in (req.system_prompt or "", context) if part]
+            llm_messages = messages
+            if system_parts:
+                llm_messages = [{"role": "system", "content": "\n\n".join(system_parts)}, *messages]
             for kind, data in llm_client.chat_stream(
                 base_url, llm_messages, max_tokens=4096, enable_thinking=False
             ):
                 if kind == "content":
-                    accumulated += data
-                    yield f"data: {json.dumps({'type': 'token', 'content': data}, ensure_ascii=False)}\n\n"
+                    content_parts.append(data)
+                    yield _token_frame(data)
                 elif kind == "metrics":
                     generation_metrics = data
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
             return
 
+        accumulated = "".join(content_parts)
         assistant_message = None
         if accumulated and req.persist_assistant:
             assistant_message = store.append_message(req.session_id, "assistant", accumulated)
             if user_content:
-                store.save_turn_memory(req.session_id, user_content, accumulated)
+                _save_turn_memory_later(req.session_id, user_content, accumulated)
 
         yield f"data: {json.dumps({'type': 'done', 'message': assistant_message, 'user_message': user_message, 'metrics': generation_metrics})}\n\n"
 
     return StreamingResponse(
         generate(),
         media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        headers=SSE_HEADERS,
     )
 
 
@@ -700,38 +768,30 @@ async def chat_agent_stream(req: ChatRequest):
 
     messages = [{"role": m.role, "content": m.content} for m in req.messages]
     user_content = messages[-1]["content"] if messages and messages[-1]["role"] == "user" else ""
-    context = ""
-    if user_content:
-        context = await asyncio.to_thread(
-            store.build_combined_context,
-            req.session_id,
-            user_content,
-        )
-
-    # Qwen3 系テンプレートは system メッセージが複数あると 400 を返すため、必ず1つに結合する
-    system_parts = [
-        part for part in (req.system_prompt or "", chat_agent.AGENT_SYSTEM_PROMPT, context) if part
-    ]
-    llm_messages = [{"role": "system", "content": "\n\n".join(system_parts)}, *messages]
 
-    user_message = None
-    if user_content and req.persist_user:
-        existing = await asyncio.to_thread(store.list_messages, req.session_id)
-        is_first = len(existing) == 0
-        user_message = await asyncio.to_thread(store.append_message, req.session_id, "user", user_content)
-        if is_first:
-            await asyncio.to_thread(store.rename_session, req.session_id, user_content[:28].strip())
+    user_message = await _persist_user_message(req.session_id, user_content) if req.persist_user else None
 
     def generate():
         final_text = ""
         final_metrics = {}
         yield f"data: {json.dumps({'type': 'model', 'name': model_name}, ensure_ascii=False)}\n\n"
         try:
+            # 記憶・資料の検索（埋め込み計算を含む）はストリーム開始後に行い、
+            # その間も UI には model イベントで応答の開始を先に見せておく
+            context = store.build_combined_context(req.session_id, user_content) if user_content else ""
+            # Qwen3 系テンプレートは system メッセージが複数あると 400 を返すため、必ず1つに結合する
+            system_parts = [
+                part for part in (req.system_prompt or "", chat_agent.AGENT_SYSTEM_PROMPT, context) if part
+            ]
+            llm_messages = [{"role": "system", "content": "\n\n".join(system_parts)}, *messages]
             for event in chat_agent.run_chat_agent(llm_messages, base_url=base_url):
                 if event.get("type") == "_final":
                     final_text = event.get("content") or ""
                     final_metrics = event.get("metrics") or {}
                     continue
+                if event.get("type") == "token":
+                    yield _token_frame(event["content"])
+                    continue
                 yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
@@ -741,14 +801,14 @@ async def chat_agent_stream(req: ChatRequest):
         if final_text and req.persist_assistant:
             assistant_message = store.append_message(req.session_id, "assistant", final_text)
             if user_content:
-                store.save_turn_memory(req.session_id, user_content, final_text)
+                _save_turn_memory_later(req.session_id, user_content, final_text)
 
         yield f"data: {json.dumps({'type': 'done', 'message': assistant_message, 'user_message': user_message, 'metrics': final_metrics}, ensure_ascii=False)}\n\n"
 
     return StreamingResponse(
         generate(),
         media_type="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        headers=SSE_HEADERS,
     )
 
 
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import heapq
 import logging
 import math
 import re
@@ -8,6 +9,7 @@ import struct
 import time
 import uuid
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 from shared import atomic_write_text
@@ -18,6 +20,27 @@ EMBED_DIM = 768
 logger = logging.getLogger(__name__)
 
 _vec_warned = False
+# sqlite_vec モジュールの解決結果。成功したら使い回す。未導入のときの import 失敗は
+# Python がキャッシュしないため、接続のたびに sys.path を探し直さないよう失敗時刻を覚えておき、
+# 一定時間ごとにだけ再試行する（設定画面から後から導入された場合も再起動なしで有効になる）。
+_sqlite_vec = None
+_vec_failed_at: float | None = None
+_VEC_RETRY_INTERVAL = 30.0
+
+
+def _resolve_sqlite_vec():
+    global _sqlite_vec, _vec_failed_at
+    if _sqlite_vec is not None:
+        return _sqlite_vec
+    if _vec_failed_at is not None and time.monotonic() - _vec_failed_at < _VEC_RETRY_INTERVAL:
+        raise ImportError("No module named 'sqlite_vec'")
+    try:
+        import sqlite_vec
+    except ImportError:
+        _vec_failed_at = time.monotonic()
+        raise
+    _sqlite_vec = sqlite_vec
+    return sqlite_vec
 
 
 def _connect() -> sqlite3.Connection:
@@ -25,7 +48,7 @@ def _connect() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     try:
-        import sqlite_vec
+        sqlite_vec = _resolve_sqlite_vec()
         conn.enable_load_extension(True)
         sqlite_vec.load(conn)
         conn.enable_load_extension(False)
@@ -52,6 +75,24 @@ def _new_document_chunk_id() -> str:
     return f"dc_{uuid.uuid4().hex}"
 
 
+@lru_cache(maxsize=64)
+def _placeholders(count: int) -> str:
+    """IN 句用の "?,?,..." 文字列。検索件数はほぼ固定なので同じ長さの組み立てを使い回す。"""
+    return ",".join("?" * count)
+
+
+# trigram トークナイザーは3文字未満の語句に一致しない
+FTS_MIN_QUERY_CHARS = 3
+
+
+def _fts_phrase(query: str) -> str | None:
+    """FTS5 の MATCH に渡すフレーズ。一致し得ない短い語句は None（問い合わせ自体を省く）。"""
+    phrase = query.replace('"', ' ').strip()
+    if len(phrase) < FTS_MIN_QUERY_CHARS:
+        return None
+    return f'"{phrase}"'
+
+
 def _table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
     return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
 
@@ -272,8 +313,13 @@ def normalize_stock_ticker(ticker: str) -> str:
     return str(ticker or "").strip().upper()
 
 
+_UNSAFE_DIR_CHARS = re.compile(r"[^A-Z0-9._-]+")
+
+
+@lru_cache(maxsize=256)
 def _stock_dir_name(ticker: str) -> str:
-    safe = re.sub(r"[^A-Z0-9._-]+", "_", normalize_stock_ticker(ticker))
+    # ノート一覧・保存のたびに同じ銘柄で呼ばれるため、変換結果をメモ化する
+    safe = _UNSAFE_DIR_CHARS.sub("_", normalize_stock_ticker(ticker))
     return safe.strip("._-") or "UNKNOWN"
 
 
@@ -332,6 +378,7 @@ NOTE_CATEGORIES = [
     {"key": "misc", "title": "その他", "description": "上のどれにも収まらない投資関連メモ"},
 ]
 NOTE_CATEGORY_KEYS = [c["key"] for c in NOTE_CATEGORIES]
+_NOTE_CATEGORY_BY_KEY = {c["key"]: c for c in NOTE_CATEGORIES}
 
 
 # ── カード分割ノート（stocks/<ticker>/notes/<key>.md） ─────────
@@ -341,10 +388,10 @@ def _note_card_path(ticker: str, key: str) -> Path:
 
 
 def _require_note_category(key: str) -> dict:
-    for category in NOTE_CATEGORIES:
-        if category["key"] == key:
-            return category
-    raise ValueError(f"不明なノートカテゴリーです: {key}")
+    category = _NOTE_CATEGORY_BY_KEY.get(key)
+    if category is None:
+        raise ValueError(f"不明なノートカテゴリーです: {key}")
+    return category
 
 
 def _read_note_card(ticker: str, category: dict) -> dict:
@@ -524,7 +571,7 @@ def delete_document_index(document_id: int, conn: sqlite3.Connection | None = No
             for row in conn.execute("SELECT id FROM document_chunks WHERE document_id = ?", (document_id,))
         ]
         if chunk_ids:
-            placeholders = ",".join("?" * len(chunk_ids))
+            placeholders = _placeholders(len(chunk_ids))
             conn.execute(f"DELETE FROM document_fts WHERE id IN ({placeholders})", chunk_ids)
             try:
                 conn.execute(f"DELETE FROM document_vec WHERE chunk_id IN ({placeholders})", chunk_ids)
@@ -536,6 +583,22 @@ def delete_document_index(document_id: int, conn: sqlite3.Connection | None = No
             conn.close()
 
 
+def _indexed_document_vectors(conn: sqlite3.Connection, document_id: int) -> dict[str, bytes]:
+    """索引済みチャンクの 本文 -> 埋め込み（document_vec に保存済みのバイト列）。ベクトル索引が無ければ空。"""
+    try:
+        rows = conn.execute(
+            """
+            SELECT c.content, v.embedding FROM document_chunks c
+            JOIN document_vec v ON v.chunk_id = c.id
+            WHERE c.document_id = ?
+            """,
+            (document_id,),
+        ).fetchall()
+    except sqlite3.OperationalError:  # sqlite-vec 未導入
+        return {}
+    return {row["content"]: row["embedding"] for row in rows}
+
+
 def index_document(document_id: int) -> int:
     from chat_embedder import embed
 
@@ -545,6 +608,9 @@ def index_document(document_id: int) -> int:
     chunks = split_document_text(doc.get("content", ""))
     now = _now()
     with _connect() as conn:
+        # 保存のたびに全チャンクを推論し直さないよう、本文が変わっていないチャンクは
+        # 既存の埋め込みをそのまま使う（タイトル変更や一部の追記では大半が再利用される）
+        previous_vectors = _indexed_document_vectors(conn, document_id)
         delete_document_index(document_id, conn)
         for index, text in enumerate(chunks):
             chunk_id = _new_document_chunk_id()
@@ -557,8 +623,10 @@ def index_document(document_id: int) -> int:
             )
             conn.execute("INSERT INTO document_fts (id, content) VALUES (?, ?)", (chunk_id, text))
             try:
-                vector = embed(text)
-                vec_bytes = struct.pack(f"{len(vector)}f", *vector)
+                vec_bytes = previous_vectors.get(text)
+                if vec_bytes is None:
+                    vector = embed(text)
+                    vec_bytes = struct.pack(f"{len(vector)}f", *vector)
                 conn.execute(
                     "INSERT INTO document_vec (chunk_id, embedding) VALUES (?, ?)",
                     (chunk_id, vec_bytes),
@@ -629,6 +697,14 @@ def list_messages(session_id: int) -> list[dict]:
         )]
 
 
+def has_messages(session_id: int) -> bool:
+    """会話に1件でもメッセージがあるか（初回ターンの判定用。本文は読まない）。"""
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT 1 FROM messages WHERE session_id = ? LIMIT 1", (session_id,)
+        ).fetchone() is not None
+
+
 def append_message(session_id: int, role: str, content: str) -> dict:
     now = _now()
     with _connect() as conn:
@@ -737,7 +813,7 @@ def get_session_workspace(session_id: int) -> int | None:
 def _delete_memory_ids(conn: sqlite3.Connection, chunk_ids: list[str]) -> None:
     if not chunk_ids:
         return
-    placeholders = ",".join("?" * len(chunk_ids))
+    placeholders = _placeholders(len(chunk_ids))
     conn.execute(f"DELETE FROM memory_fts WHERE id IN ({placeholders})", chunk_ids)
     try:
         conn.execute(f"DELETE FROM memory_vec WHERE chunk_id IN ({placeholders})", chunk_ids)
@@ -837,9 +913,9 @@ def search_memory(
             session_filter = " AND mc.session_id != ?"
             session_params.append(exclude_session_id)
 
-        safe_query = '"' + query.replace('"', ' ') + '"'
+        safe_query = _fts_phrase(query)
         try:
-            rows = conn.execute(
+            rows = [] if safe_query is None else conn.execute(
                 """
                 SELECT mc.id FROM memory_fts mf
                 JOIN memory_chunks mc ON mc.id = mf.id
@@ -865,7 +941,7 @@ def search_memory(
             ).fetchall()
             if vec_rows:
                 vec_ids = [row["chunk_id"] for row in vec_rows]
-                placeholders = ",".join("?" * len(vec_ids))
+                placeholders = _placeholders(len(vec_ids))
                 allowed = {
                     row["id"]
                     for row in conn.execute(
@@ -885,36 +961,51 @@ def search_memory(
         if not scores:
             return []
 
+        # 減衰後の順位付けに要るのは作成時刻だけなので、候補（最大 top_k * 8 件）は本文を読まずに
+        # 順位を決め、本文を含む行は上位 top_k 件だけ読み込む
         ids = list(scores.keys())
-        placeholders = ",".join("?" * len(ids))
+        created_at = {
+            row["id"]: int(row["created_at"])
+            for row in conn.execute(
+                f"SELECT id, created_at FROM memory_chunks WHERE id IN ({_placeholders(len(ids))})",
+                ids,
+            )
+        }
+        now = _now()
+        # 0.5 ** (経過日数 / 半減期) を exp(-rate * 経過ms) に畳み込み、行ごとの除算・分岐を省く
+        # （半減期 0 以下は rate = 0 で減衰なし）
+        decay_rate = math.log(2) / (half_life_days * 86_400_000) if half_life_days > 0 else 0.0
+        decays = {
+            chunk_id: math.exp(-decay_rate * max(0, now - created))
+            for chunk_id, created in created_at.items()
+        }
+        ranked_ids = heapq.nlargest(
+            top_k,
+            (chunk_id for chunk_id in ids if chunk_id in decays),
+            key=lambda chunk_id: scores[chunk_id] * decays[chunk_id],
+        )
+        if not ranked_ids:
+            return []
         rows = conn.execute(
             f"""
             SELECT id, workspace_id, session_id, chunk_type, content, created_at
             FROM memory_chunks
-            WHERE id IN ({placeholders})
+            WHERE id IN ({_placeholders(len(ranked_ids))})
             """,
-            ids,
+            ranked_ids,
         ).fetchall()
 
-    now = _now()
     chunks = {row["id"]: dict(row) for row in rows}
-
-    def decayed_score(chunk_id: str) -> float:
+    results = []
+    for chunk_id in ranked_ids:
         row = chunks.get(chunk_id)
-        if not row:
-            return 0.0
-        if half_life_days <= 0:
-            decay = 1.0
-        else:
-            days_elapsed = max(0.0, (now - int(row["created_at"])) / 86_400_000)
-            decay = math.pow(0.5, days_elapsed / half_life_days)
-        row["score"] = scores[chunk_id] * decay
+        if row is None:
+            continue
+        row["score"] = scores[chunk_id] * decays[chunk_id]
         row["base_score"] = scores[chunk_id]
-        row["decay"] = decay
-        return row["score"]
-
-    ranked_ids = sorted(scores.keys(), key=decayed_score, reverse=True)[:top_k]
-    return [chunks[cid] for cid in ranked_ids if cid in chunks]
+        row["decay"] = decays[chunk_id]
+        results.append(row)
+    return results
 
 
 def search_memory_for_session(
@@ -955,6 +1046,28 @@ def _safe_count(conn: sqlite3.Connection, table: str) -> int:
         return 0
 
 
+# 検索コンテキストの見出し（固定文言なので組み立て済みの文字列として持つ）
+MEMORY_CONTEXT_HEADER = (
+    "## 過去の会話から検索された関連記憶\n"
+    "以下は同じワークスペース内の過去会話から自動検索された情報です。\n"
+    "回答に役立つ場合だけ自然に参照してください。\n"
+)
+DOCUMENT_CONTEXT_HEADER = (
+    "## ワークスペース DOCUMENTS から検索された関連情報\n"
+    "以下はワークスペース内の DOCUMENTS から自動検索された情報です。\n"
+    "回答に役立つ場合だけ自然に参照してください。\n"
+)
+
+
+def _format_context(header: str, entries, max_chars: int) -> str:
+    """検索結果を「見出し + 空行区切りの [ラベル] 本文」のコンテキストに整形し、max_chars で切る。
+
+    entries は (ラベル, 本文) の列。記憶・DOCUMENTS の両コンテキストで共通の書式。
+    """
+    context = (header + "".join(f"\n{label}\n{content}\n" for label, content in entries)).strip()
+    return context[:max_chars] if max_chars > 0 else context
+
+
 def build_memory_context(
     session_id: int,
     query: str,
@@ -977,19 +1090,11 @@ def build_memory_context(
     if not items:
         return ""
 
-    lines = [
-        "## 過去の会話から検索された関連記憶",
-        "以下は同じワークスペース内の過去会話から自動検索された情報です。",
-        "回答に役立つ場合だけ自然に参照してください。",
-        "",
-    ]
-    for i, item in enumerate(items, 1):
-        lines.append(f"[記憶 {i}]")
-        lines.append(item["content"])
-        lines.append("")
-
-    context = "\n".join(lines).strip()
-    return context[:max_chars] if max_chars > 0 else context
+    return _format_context(
+        MEMORY_CONTEXT_HEADER,
+        ((f"[記憶 {i}]", item["content"]) for i, item in enumerate(items, 1)),
+        max_chars,
+    )
 
 
 def search_documents(
@@ -1004,9 +1109,9 @@ def search_documents(
     rrf_k = 60
     scores: dict[str, float] = {}
     with _connect() as conn:
-        safe_query = '"' + query.replace('"', ' ') + '"'
+        safe_query = _fts_phrase(query)
         try:
-            rows = conn.execute(
+            rows = [] if safe_query is None else conn.execute(
                 """
                 SELECT dc.id FROM document_fts df
                 JOIN document_chunks dc ON dc.id = df.id
@@ -1031,7 +1136,7 @@ def search_documents(
             ).fetchall()
             if vec_rows:
                 vec_ids = [row["chunk_id"] for row in vec_rows]
-                placeholders = ",".join("?" * len(vec_ids))
+                placeholders = _placeholders(len(vec_ids))
                 allowed = {
                     row["id"]
                     for row in conn.execute(
@@ -1048,23 +1153,22 @@ def search_documents(
         if not scores:
             return []
 
-        ids = list(scores.keys())
-        placeholders = ",".join("?" * len(ids))
+        # RRF のスコアだけで順位が決まるため、上位 top_k 件を先に選んでから本文を読む
+        ranked_ids = heapq.nlargest(top_k, scores, key=scores.__getitem__)
         rows = conn.execute(
             f"""
             SELECT dc.id, dc.document_id, dc.workspace_id, dc.chunk_index, dc.content, dc.created_at,
                    wd.title AS document_title
             FROM document_chunks dc
             JOIN workspace_documents wd ON wd.id = dc.document_id
-            WHERE dc.id IN ({placeholders})
+            WHERE dc.id IN ({_placeholders(len(ranked_ids))})
             """,
-            ids,
+            ranked_ids,
         ).fetchall()
 
     chunks = {row["id"]: dict(row) for row in rows}
     for chunk_id, row in chunks.items():
-        row["score"] = scores.get(chunk_id, 0.0)
-    ranked_ids = sorted(scores.keys(), key=lambda cid: scores[cid], reverse=True)[:top_k]
+        row["score"] = scores[chunk_id]
     return [chunks[cid] for cid in ranked_ids if cid in chunks]
 
 
@@ -1092,22 +1196,21 @@ def build_document_context(
     if not items:
         return ""
 
-    lines = [
-        "## ワークスペース DOCUMENTS から検索された関連情報",
-        "以下はワークスペース内の DOCUMENTS から自動検索された情報です。",
-        "回答に役立つ場合だけ自然に参照してください。",
-        "",
-    ]
-    for item in items:
-        lines.append(f"[DOCUMENT: {item.get('document_title') or 'Untitled'}]")
-        lines.append(item["content"])
-        lines.append("")
-
-    context = "\n".join(lines).strip()
-    return context[:max_chars] if max_chars > 0 else context
+    return _format_context(
+        DOCUMENT_CONTEXT_HEADER,
+        ((f"[DOCUMENT: {item.get('document_title') or 'Untitled'}]", item["content"]) for item in items),
+        max_chars,
+    )
+
+
+# チャットの system prompt に差し込む検索コンテキストの構成（この順に連結）。
+# 検索元を増やすときは (builder(session_id, query, **options) -> str, options) をここに足す。
+CONTEXT_SOURCES = (
+    (build_document_context, {"top_k": 3, "max_chars": 2000}),
+    (build_memory_context, {"top_k": 5, "max_chars": 1500, "half_life_days": 30}),
+)
 
 
 def build_combined_context(session_id: int, query: str) -> str:
-    doc_context = build_document_context(session_id, query, top_k=3, max_chars=2000)
-    memory_context = build_memory_context(session_id, query, top_k=5, max_chars=1500, half_life_days=30)
-    return "\n\n".join(part for part in (doc_context, memory_context) if part)
+    parts = (builder(session_id, query, **options) for builder, options in CONTEXT_SOURCES)
+    return "\n\n".join(part for part in parts if part)
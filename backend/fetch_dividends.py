@@ -1,10 +1,14 @@
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 import yfinance as yf
 
-from shared import to_float, convert_to_jpy, normalize_price_currency
+from shared import to_float, convert_to_jpy, normalize_price_currency, yahoo_limiter
+
+# Yahoo への同時問い合わせ数の上限（多すぎるとレート制限で失敗が増える）
+MAX_WORKERS = 4
 
 
 def estimate_annual_dividend(ticker_symbol: str) -> dict:
@@ -47,6 +51,14 @@ def estimate_annual_dividend(ticker_symbol: str) -> dict:
     }
 
 
+def estimate_safely(ticker_symbol: str):
+    yahoo_limiter.acquire()
+    try:
+        return estimate_annual_dividend(ticker_symbol), None
+    except Exception as exc:
+        return None, str(exc)
+
+
 def main():
     payload = json.loads(sys.stdin.read() or "{}")
     holdings = payload.get("holdings", [])
@@ -70,10 +82,13 @@ def main():
             shares_by_ticker[ticker] = 0.0
         shares_by_ticker[ticker] += float(shares)
 
-    for ticker in ticker_order:
-        shares = shares_by_ticker[ticker]
-        try:
-            estimate = estimate_annual_dividend(ticker)
+    # 銘柄ごとの info 取得は HTTP 待ちが大半なので、上限付きで並行に取得する（集計は入力順）
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for ticker, (estimate, error) in zip(ticker_order, pool.map(estimate_safely, ticker_order)):
+            if error is not None:
+                summary["errors"][ticker] = error
+                continue
+            shares = shares_by_ticker[ticker]
             annual_per_share_jpy = estimate.get("annualDividendPerShareJpy")
             total_jpy = float(annual_per_share_jpy) * float(shares) if annual_per_share_jpy else 0.0
             summary["positions"][ticker] = {
@@ -82,8 +97,6 @@ def main():
                 "totalAnnualDividendJpy": float(total_jpy),
             }
             summary["totalAnnualDividendJpy"] += float(total_jpy)
-        except Exception as exc:
-            summary["errors"][ticker] = str(exc)
 
     print(json.dumps(summary, ensure_ascii=False))
     return 0
@@ -12,6 +12,7 @@ ISIN より右側の数値だけを右揃えの x 座標で12列へ割り当て
 """
 from __future__ import annotations
 
+import bisect
 import io
 import json
 import re
@@ -19,9 +20,8 @@ import sqlite3
 import sys
 from datetime import datetime, timedelta, timezone
 
-import requests
-
 from paths import DB_FILE
+from shared import utc_now_iso
 
 PAGE_URL = "https://www.jpx.co.jp/markets/statistics-equities/margin/05.html"
 JPX_ORIGIN = "https://www.jpx.co.jp"
@@ -35,6 +35,7 @@ PDF_LINK = re.compile(r'href="([^"]*syumatsu(\d{8})00\.pdf)"')
 NUM = re.compile(r"^[0-9][0-9,]*$")
 CODE = re.compile(r"^[0-9][0-9A-Z]{3}[0-9]$")
 ISIN = re.compile(r"^JP[0-9A-Z]{10}$")
+TSE_TICKER = re.compile(r"([0-9A-Z]{4,5})\.T")
 
 
 def normalize_code(code5: str) -> str:
@@ -44,7 +45,7 @@ def normalize_code(code5: str) -> str:
 
 def code_for_ticker(symbol: str) -> str | None:
     """'7203.T' のような東証ティッカーから照合用コードを取り出す。対象外は None。"""
-    match = re.fullmatch(r"([0-9A-Z]{4,5})\.T", str(symbol).strip().upper())
+    match = TSE_TICKER.fullmatch(str(symbol).strip().upper())
     return match.group(1) if match else None
 
 
@@ -58,6 +59,11 @@ def _group_lines(words, tol=4.0):
     return [sorted(ws, key=lambda w: w["x0"]) for _, ws in lines]
 
 
+def _is_isin(text: str) -> bool:
+    # 1行に十数語あっても ISIN は1語だけなので、正規表現の前に長さ・接頭辞の比較で大半を落とす
+    return len(text) == 12 and text.startswith("JP") and ISIN.match(text) is not None
+
+
 def parse_margin_pdf(pdf_bytes: bytes) -> dict[str, tuple[int, int]]:
     """PDF から {正規化コード: (売残, 買残)} を返す。"""
     import pdfplumber  # 重い依存のため遅延 import
@@ -66,12 +72,13 @@ def parse_margin_pdf(pdf_bytes: bytes) -> dict[str, tuple[int, int]]:
     with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
         for page in pdf.pages:
             for words in _group_lines(page.extract_words()):
-                isin_word = next((w for w in words if ISIN.match(w["text"])), None)
+                isin_word = next((w for w in words if _is_isin(w["text"])), None)
                 if not isin_word:
                     continue
+                # 位置の比較は正規表現より安く、ISIN より右の語（数値列）をまとめて除外できる
                 code = next(
                     (w["text"] for w in words
-                     if CODE.match(w["text"]) and w["x1"] <= isin_word["x0"] + 1),
+                     if w["x1"] <= isin_word["x0"] + 1 and CODE.match(w["text"])),
                     None,
                 )
                 if not code:
@@ -105,17 +112,20 @@ def parse_margin_pdf(pdf_bytes: bytes) -> dict[str, tuple[int, int]]:
     if len(centers) != 12:
         raise RuntimeError(f"PDFの列構造を解釈できませんでした（{len(centers)}列を検出）")
 
+    # 隣り合う列中心の中点を境界にすれば、最寄りの列は二分探索1回で決まる
+    # （bisect_left: 中点ちょうどは左の列。最寄り判定の同距離時と同じ）
+    bounds = [(a + b) / 2 for a, b in zip(centers, centers[1:])]
+
     result: dict[str, tuple[int, int]] = {}
     for code, values in raw_rows:
         columns: list[int | None] = [None] * 12
         for x, value in values:
-            index = min(range(12), key=lambda i: abs(centers[i] - x))
-            columns[index] = value
+            columns[bisect.bisect_left(bounds, x)] = value
         sell, buy = columns[0], columns[2]
         if sell is None or buy is None:
             continue
         components = (columns[4], columns[6], columns[8], columns[10])
-        if all(v is not None for v in components) and (
+        if None not in components and (
             sell != components[0] + components[1] or buy != components[2] + components[3]
         ):
             continue  # 列ずれの疑いがある行は取り込まない
@@ -137,8 +147,20 @@ def _connect():
     return conn
 
 
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+_session = None
+
+
+def _http_get(url: str, timeout: float):
+    """JPX への GET。ページと各週の PDF は同じホストなので、接続（TLS）を使い回す。"""
+    global _session
+    if _session is None:
+        import requests  # 重い依存のため遅延 import（蓄積済みデータの読み出しでは使わない）
+
+        _session = requests.Session()
+        _session.headers.update(HTTP_HEADERS)
+    response = _session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response
 
 
 def _upsert_week(conn, week_date: str, balances: dict[str, tuple[int, int]], now: str) -> None:
@@ -152,49 +174,71 @@ def _upsert_week(conn, week_date: str, balances: dict[str, tuple[int, int]], now
     )
 
 
+def _load_meta(conn) -> dict[str, str]:
+    """取り込みの判定に使う margin_meta（自動取り込み設定と最終確認時刻）を1回の問い合わせで読む。"""
+    return dict(conn.execute(
+        "SELECT key, value FROM margin_meta WHERE key IN ('auto_ingest', 'last_checked')"
+    ))
+
+
+def _checked_recently(meta: dict[str, str]) -> bool:
+    last_checked = meta.get("last_checked")
+    if not last_checked:
+        return False
+    try:
+        last = datetime.fromisoformat(last_checked.replace("Z", "+00:00"))
+    except ValueError:
+        return False
+    return datetime.now(timezone.utc) - last < CHECK_INTERVAL
+
+
+def _ingest_new_weeks(conn) -> dict:
+    page = _http_get(PAGE_URL, timeout=30)
+    links = {}  # week_date -> url
+    for href, ymd in PDF_LINK.findall(page.text):
+        week_date = f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}"
+        links[week_date] = href if href.startswith("http") else JPX_ORIGIN + href
+
+    # 蓄積済みの全週（毎週増える）ではなく、ページに載っている数週分だけを照合する
+    candidates = sorted(links)
+    known = {
+        r[0]
+        for r in conn.execute(
+            "SELECT DISTINCT week_date FROM margin_history WHERE week_date IN "
+            f"({','.join('?' * len(candidates))})",
+            candidates,
+        )
+    } if candidates else set()
+    now = utc_now_iso()
+    ingested = []
+    for week_date in candidates:
+        if week_date in known:
+            continue
+        pdf = _http_get(links[week_date], timeout=60)
+        balances = parse_margin_pdf(pdf.content)
+        if not balances:
+            continue
+        _upsert_week(conn, week_date, balances, now)
+        # 次の PDF のダウンロード中に書き込みロックを握り続けないよう、週ごとに確定する
+        # （fetch_review は Yahoo の日足保存と並行してこの取り込みを走らせる）
+        conn.commit()
+        ingested.append({"weekDate": week_date, "count": len(balances)})
+    conn.execute(
+        "INSERT INTO margin_meta (key, value) VALUES ('last_checked', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (now,),
+    )
+    conn.commit()
+    return {"checked": True, "ingested": ingested}
+
+
 def ingest(throttle: bool = True) -> dict:
     """JPX ページを確認し、未取り込みの週の PDF を蓄積する。"""
     conn = _connect()
     try:
-        if throttle:
-            row = conn.execute(
-                "SELECT value FROM margin_meta WHERE key = 'last_checked'"
-            ).fetchone()
-            if row:
-                try:
-                    last = datetime.fromisoformat(row[0].replace("Z", "+00:00"))
-                    if datetime.now(timezone.utc) - last < CHECK_INTERVAL:
-                        return {"checked": False, "ingested": []}
-                except ValueError:
-                    pass
-
-        page = requests.get(PAGE_URL, headers=HTTP_HEADERS, timeout=30)
-        page.raise_for_status()
-        links = {}  # week_date -> url
-        for href, ymd in PDF_LINK.findall(page.text):
-            week_date = f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}"
-            links[week_date] = href if href.startswith("http") else JPX_ORIGIN + href
-
-        known = {r[0] for r in conn.execute("SELECT DISTINCT week_date FROM margin_history")}
-        now = _utc_now_iso()
-        ingested = []
-        for week_date in sorted(links):
-            if week_date in known:
-                continue
-            pdf = requests.get(links[week_date], headers=HTTP_HEADERS, timeout=60)
-            pdf.raise_for_status()
-            balances = parse_margin_pdf(pdf.content)
-            if not balances:
-                continue
-            _upsert_week(conn, week_date, balances, now)
-            ingested.append({"weekDate": week_date, "count": len(balances)})
-        conn.execute(
-            "INSERT INTO margin_meta (key, value) VALUES ('last_checked', ?) "
-            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (now,),
-        )
-        conn.commit()
-        return {"checked": True, "ingested": ingested}
+        if throttle and _checked_recently(_load_meta(conn)):
+            return {"checked": False, "ingested": []}
+        return _ingest_new_weeks(conn)
     finally:
         conn.close()
 
@@ -254,9 +298,15 @@ def ingest_safely(symbol: str) -> None:
     if not code_for_ticker(symbol):
         return
     try:
-        if not get_settings()["autoIngest"]:
-            return
-        ingest(throttle=True)
+        # 設定と最終確認時刻は同じ接続で一度に読む（ほとんどの呼び出しはここで終わる）
+        conn = _connect()
+        try:
+            meta = _load_meta(conn)
+            if meta.get("auto_ingest") == "0" or _checked_recently(meta):
+                return
+            _ingest_new_weeks(conn)
+        finally:
+            conn.close()
     except Exception as error:
         print(f"margin ingest failed: {error}", file=sys.stderr)
 
@@ -1,47 +1,60 @@
 import json
 import sqlite3
 import sys
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import yfinance as yf
 
 import fetch_margin
-from shared import to_float
+from shared import dumps_json_bytes, first_positive, loads_json, to_float, utc_now_iso
 from paths import DB_FILE
+from review_cache import load_candles
 
 MAX_FINANCIAL_SUMMARY_PERIODS = 4
-
-
-OVERVIEW_FIELDS = {
-    "sector": "sector",
-    "industry": "industry",
-    "currentPrice": "currentPrice",
-    "marketCap": "marketCap",
-    "fiftyTwoWeekHigh": "fiftyTwoWeekHigh",
-    "fiftyTwoWeekLow": "fiftyTwoWeekLow",
-}
-
-VALUATION_FIELDS = {
-    "trailingPE": "trailingPE",
-    "priceToBook": "priceToBook",
-    "enterpriseToEbitda": "enterpriseToEbitda",
-    "dividendYield": "dividendYield",
-    "dividendRate": "dividendRate",
-    "trailingAnnualDividendRate": "trailingAnnualDividendRate",
-}
-
-PROFITABILITY_FIELDS = {
-    "returnOnEquity": "returnOnEquity",
-    "returnOnAssets": "returnOnAssets",
-    "operatingMargins": "operatingMargins",
-}
-
-ANALYST_FIELDS = {
-    "numberOfAnalystOpinions": "numberOfAnalystOpinions",
-    "targetMeanPrice": "targetMeanPrice",
-    "targetHighPrice": "targetHighPrice",
-    "targetLowPrice": "targetLowPrice",
-    "recommendationKey": "recommendationKey",
+# 財務サマリー（年次の損益計算書）は日中に変わらないため、保存済みスナップショットが
+# この期間内なら Yahoo へ取り直さずに使う
+FINANCIAL_SUMMARY_MAX_AGE = timedelta(hours=24)
+
+
+# Yahoo の info キーをそのまま payload のキーとして使う項目（キー名の付け替えは無い）
+OVERVIEW_FIELDS = (
+    "sector",
+    "industry",
+    "currentPrice",
+    "marketCap",
+    "fiftyTwoWeekHigh",
+    "fiftyTwoWeekLow",
+)
+
+VALUATION_FIELDS = (
+    "trailingPE",
+    "priceToBook",
+    "enterpriseToEbitda",
+    "dividendYield",
+    "dividendRate",
+    "trailingAnnualDividendRate",
+)
+
+PROFITABILITY_FIELDS = (
+    "returnOnEquity",
+    "returnOnAssets",
+    "operatingMargins",
+)
+
+ANALYST_FIELDS = (
+    "numberOfAnalystOpinions",
+    "targetMeanPrice",
+    "targetHighPrice",
+    "targetLowPrice",
+    "recommendationKey",
+)
+
+# 損益計算書の payload キー -> 行名の候補（先に見つかった行を使う）
+FINANCIAL_ROW_CANDIDATES = {
+    "revenue": ("Total Revenue", "Operating Revenue"),
+    "operatingIncome": ("Operating Income",),
+    "netIncome": ("Net Income", "Net Income Common Stockholders"),
 }
 
 
@@ -91,6 +104,14 @@ def load_fast_info_safe(ticker):
         return {}
 
 
+def call_safe(func, ticker, fallback):
+    """取得に失敗しても画面全体は出せるよう、その項目だけ fallback にする。"""
+    try:
+        return func(ticker)
+    except Exception:
+        return fallback
+
+
 def load_price_history(ticker):
     try:
         history = ticker.history(period="1y", interval="1d", auto_adjust=False)
@@ -104,14 +125,17 @@ def load_price_history(ticker):
 def refresh_price_history(symbol):
     """日足だけを再取得し、既存の蓄積データへ上書き保存する。"""
     ticker = yf.Ticker(symbol)
-    try:
-        history = ticker.history(period="1y", interval="1d", auto_adjust=False)
-    except Exception as error:
-        raise RuntimeError(f"日足を取得できませんでした: {error}") from error
-    if history is None or getattr(history, "empty", True):
-        raise RuntimeError("日足を取得できませんでした（データが空です）")
-    price_history = store_and_load_candles(symbol, history)
-    fetch_margin.ingest_safely(symbol)
+    # 信用残の蓄積は日足の取得と独立しているため、Yahoo の応答を待つ間に進めておく
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        margin_future = pool.submit(fetch_margin.ingest_safely, symbol)
+        try:
+            history = ticker.history(period="1y", interval="1d", auto_adjust=False)
+        except Exception as error:
+            raise RuntimeError(f"日足を取得できませんでした: {error}") from error
+        if history is None or getattr(history, "empty", True):
+            raise RuntimeError("日足を取得できませんでした（データが空です）")
+        price_history = store_and_load_candles(symbol, history)
+        margin_future.result()
     return {
         "ticker": symbol,
         "fetchedCount": len(history.index),
@@ -131,19 +155,23 @@ def store_and_load_candles(symbol, history):
             ticker TEXT NOT NULL, trade_date TEXT NOT NULL, open REAL, high REAL,
             low REAL, close REAL, volume INTEGER, updated_at TEXT NOT NULL,
             PRIMARY KEY (ticker, trade_date))""")
-        now = datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+        now = utc_now_iso()
         if history is not None:
+            # iterrows は1行ごとに Series を組み立てて遅いため、列ごとに list へ取り出して zip する
+            def column(name):
+                return history[name].tolist() if name in history else [None] * len(history.index)
+
             rows = []
-            for index, row in history.iterrows():
-                open_price = to_float(row.get("Open"))
-                high = to_float(row.get("High"))
-                low = to_float(row.get("Low"))
-                close = to_float(row.get("Close"))
-                if any(value is None or value <= 0 for value in (open_price, high, low, close)):
+            for trade_date, open_price, high, low, close, volume in zip(
+                history.index.strftime("%Y-%m-%d"),
+                column("Open"), column("High"), column("Low"), column("Close"), column("Volume"),
+            ):
+                ohlc = (to_float(open_price), to_float(high), to_float(low), to_float(close))
+                # 欠損・0 以下を含む行は捨てる（行ごとに generator を作る any() は使わない）
+                if None in ohlc or min(ohlc) <= 0:
                     continue
-                volume = to_float(row.get("Volume"))
-                rows.append((symbol, index.strftime("%Y-%m-%d"), open_price,
-                    high, low, close,
+                volume = to_float(volume)
+                rows.append((symbol, trade_date, *ohlc,
                     int(volume) if volume is not None else None, now))
             conn.executemany("""INSERT INTO review_price_history
                 (ticker, trade_date, open, high, low, close, volume, updated_at)
@@ -152,14 +180,9 @@ def store_and_load_candles(symbol, history):
                 high=excluded.high, low=excluded.low, close=excluded.close,
                 volume=excluded.volume, updated_at=excluded.updated_at""", rows)
             conn.commit()
-        stored = conn.execute("""SELECT trade_date, open, high, low, close, volume
-            FROM review_price_history
-            WHERE ticker = ? AND open > 0 AND high > 0 AND low > 0 AND close > 0
-            ORDER BY trade_date""", (symbol,)).fetchall()
+        return load_candles(conn, symbol)
     finally:
         conn.close()
-    return [{"date": r[0], "open": r[1], "high": r[2], "low": r[3],
-             "close": r[4], "volume": r[5]} for r in stored]
 
 
 def store_review_snapshot(symbol, payload):
@@ -172,7 +195,7 @@ def store_review_snapshot(symbol, payload):
         conn.execute("PRAGMA busy_timeout = 10000")
         conn.execute("""CREATE TABLE IF NOT EXISTS review_snapshots (
             ticker TEXT PRIMARY KEY, payload_json TEXT NOT NULL, updated_at TEXT NOT NULL)""")
-        now = datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+        now = utc_now_iso()
         conn.execute(
             """INSERT INTO review_snapshots (ticker, payload_json, updated_at) VALUES (?, ?, ?)
                ON CONFLICT(ticker) DO UPDATE SET
@@ -184,6 +207,69 @@ def store_review_snapshot(symbol, payload):
         conn.close()
 
 
+def load_snapshot(symbol):
+    """保存済みスナップショットの (payload, 保存時刻 ISO) を返す。無い・壊れていれば (None, None)。"""
+    if not DB_FILE.exists():
+        return None, None
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        row = conn.execute(
+            "SELECT payload_json, updated_at FROM review_snapshots WHERE ticker = ?", (symbol,)
+        ).fetchone()
+    except sqlite3.OperationalError:  # review_snapshots 未作成
+        return None, None
+    finally:
+        conn.close()
+    if not row:
+        return None, None
+    try:
+        snapshot = loads_json(row[0])
+    except ValueError:
+        return None, None
+    if not isinstance(snapshot, dict):
+        return None, None
+    return snapshot, row[1]
+
+
+def _age_of(timestamp):
+    return datetime.now(timezone.utc) - datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+
+
+def load_fresh_snapshot(symbol, max_age):
+    """max_age 以内に保存されたスナップショットを返す（無い・古ければ None）。
+
+    画面で銘柄を開くたびに保存されるため、直後のチャットなどは Yahoo へ取り直さずに済む。
+    """
+    snapshot, updated_at = load_snapshot(symbol)
+    if snapshot is None:
+        return None
+    try:
+        age = _age_of(updated_at)
+    except (TypeError, ValueError):
+        return None
+    return snapshot if age <= max_age else None
+
+
+def load_recent_financial_summary(symbol):
+    """保存済みスナップショットの (財務サマリー, その取得時刻) を返す。無い・古い・空なら (None, None)。
+
+    スナップショット自体は開くたびに保存し直されるため、鮮度は財務サマリーを
+    Yahoo から取得した時刻（financialSummaryFetchedAt）で判定する。
+    """
+    snapshot, updated_at = load_snapshot(symbol)
+    if snapshot is None:
+        return None, None
+    try:
+        fetched_at = str(snapshot.get("financialSummaryFetchedAt") or updated_at)
+        age = _age_of(fetched_at)
+    except (TypeError, ValueError):
+        return None, None
+    summary = snapshot.get("financialSummary")
+    if age > FINANCIAL_SUMMARY_MAX_AGE or not isinstance(summary, list) or not summary:
+        return None, None
+    return summary, fetched_at
+
+
 def get_history_fallback_prices(history):
     if history is None or getattr(history, "empty", True):
         return {}
@@ -192,22 +278,24 @@ def get_history_fallback_prices(history):
     if len(closes) == 0:
         return {}
 
-    high_date = None
-    low_date = None
+    # 高値・安値とその日付は、列を1度だけ取り出して同じ位置から求める
+    high = low = high_date = low_date = None
     if "High" in history:
         highs = history["High"].dropna()
         if len(highs):
-            high_date = format_month_day(highs.idxmax())
+            pos = highs.to_numpy().argmax()
+            high, high_date = to_float(highs.iloc[pos]), format_month_day(highs.index[pos])
     if "Low" in history:
         lows = history["Low"].dropna()
         if len(lows):
-            low_date = format_month_day(lows.idxmin())
+            pos = lows.to_numpy().argmin()
+            low, low_date = to_float(lows.iloc[pos]), format_month_day(lows.index[pos])
 
     result = {
         "currentPrice": to_float(closes.iloc[-1]),
         "previousClose": to_float(closes.iloc[-2]) if len(closes) >= 2 else None,
-        "fiftyTwoWeekHigh": to_float(history["High"].max()) if "High" in history else None,
-        "fiftyTwoWeekLow": to_float(history["Low"].min()) if "Low" in history else None,
+        "fiftyTwoWeekHigh": high,
+        "fiftyTwoWeekLow": low,
         "fiftyTwoWeekHighDate": high_date,
         "fiftyTwoWeekLowDate": low_date,
     }
@@ -215,27 +303,27 @@ def get_history_fallback_prices(history):
 
 
 def build_overview(info, fast_info, history_fallback):
-    overview = {key: info.get(field) for key, field in OVERVIEW_FIELDS.items()}
-    overview["currentPrice"] = (
-        overview.get("currentPrice")
-        or fast_info.get("lastPrice")
-        or fast_info.get("regularMarketPrice")
-        or history_fallback.get("currentPrice")
+    overview = {key: info.get(key) for key in OVERVIEW_FIELDS}
+    overview["currentPrice"] = first_positive(
+        overview.get("currentPrice"),
+        fast_info.get("lastPrice"),
+        fast_info.get("regularMarketPrice"),
+        history_fallback.get("currentPrice"),
     )
-    overview["previousClose"] = (
-        info.get("previousClose")
-        or fast_info.get("previousClose")
-        or history_fallback.get("previousClose")
+    overview["previousClose"] = first_positive(
+        info.get("previousClose"),
+        fast_info.get("previousClose"),
+        history_fallback.get("previousClose"),
     )
-    overview["fiftyTwoWeekHigh"] = (
-        overview.get("fiftyTwoWeekHigh")
-        or fast_info.get("yearHigh")
-        or history_fallback.get("fiftyTwoWeekHigh")
+    overview["fiftyTwoWeekHigh"] = first_positive(
+        overview.get("fiftyTwoWeekHigh"),
+        fast_info.get("yearHigh"),
+        history_fallback.get("fiftyTwoWeekHigh"),
     )
-    overview["fiftyTwoWeekLow"] = (
-        overview.get("fiftyTwoWeekLow")
-        or fast_info.get("yearLow")
-        or history_fallback.get("fiftyTwoWeekLow")
+    overview["fiftyTwoWeekLow"] = first_positive(
+        overview.get("fiftyTwoWeekLow"),
+        fast_info.get("yearLow"),
+        history_fallback.get("fiftyTwoWeekLow"),
     )
     overview["fiftyTwoWeekHighDate"] = history_fallback.get("fiftyTwoWeekHighDate") or ""
     overview["fiftyTwoWeekLowDate"] = history_fallback.get("fiftyTwoWeekLowDate") or ""
@@ -247,29 +335,27 @@ def extract_financial_summary(ticker):
     if table is None or getattr(table, "empty", True):
         return []
 
-    row_candidates = {
-        "revenue": ["Total Revenue", "Operating Revenue"],
-        "operatingIncome": ["Operating Income"],
-        "netIncome": ["Net Income", "Net Income Common Stockholders"],
-    }
-
-    def get_row_value(names, column):
-        for name in names:
-            if name in table.index:
-                return to_int(table.loc[name, column])
-        return None
+    columns = table.columns[:MAX_FINANCIAL_SUMMARY_PERIODS]
+    # 行名の候補探し（Yahoo の表記揺れ）と行の取り出しは指標ごとに1回だけ行い、
+    # 期間（列）ごとに .loc[行, 列] でセルを1つずつ引かない
+    row_values = {}
+    for key, names in FINANCIAL_ROW_CANDIDATES.items():
+        name = next((name for name in names if name in table.index), None)
+        if name is None:
+            row_values[key] = [None] * len(columns)
+            continue
+        row = table.loc[name]
+        if getattr(row, "ndim", 1) > 1:  # 行名が重複していれば先頭の行を使う
+            row = row.iloc[0]
+        row_values[key] = [to_int(value) for value in row.iloc[:len(columns)].tolist()]
 
     items = []
-    for column in table.columns[:MAX_FINANCIAL_SUMMARY_PERIODS]:
+    for index, column in enumerate(columns):
         label = column.strftime("%Y-%m") if hasattr(column, "strftime") else str(column)
-        items.append(
-            {
-                "period": label,
-                "revenue": get_row_value(row_candidates["revenue"], column),
-                "operatingIncome": get_row_value(row_candidates["operatingIncome"], column),
-                "netIncome": get_row_value(row_candidates["netIncome"], column),
-            }
-        )
+        item = {"period": label}
+        for key, values in row_values.items():
+            item[key] = values[index]
+        items.append(item)
     return items
 
 
@@ -301,21 +387,41 @@ def extract_news(ticker):
 
 
 def build_payload(symbol: str):
-    ticker = yf.Ticker(symbol)
-    info = load_info_safe(ticker)
-    fast_info = load_fast_info_safe(ticker)
-    history = load_price_history(ticker)
+    # info / fast_info / 日足 / 損益計算書 / ニュースは互いに独立した Yahoo への問い合わせで、
+    # 時間の大半は HTTP 往復の待ちなので並行に投げ、待ち時間を最も遅い1本分に縮める。
+    # Ticker は取得結果を内部にキャッシュするため、スレッド間で共有せず項目ごとに作る。
+    # 信用残の蓄積（JPX への問い合わせ）も Yahoo と無関係なので同じプールで並行に進める。
+    financial_summary, financial_fetched_at = load_recent_financial_summary(symbol)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        margin_future = pool.submit(fetch_margin.ingest_safely, symbol)
+        info_future = pool.submit(load_info_safe, yf.Ticker(symbol))
+        fast_info_future = pool.submit(load_fast_info_safe, yf.Ticker(symbol))
+        history_future = pool.submit(load_price_history, yf.Ticker(symbol))
+        financial_future = None
+        if financial_summary is None:
+            financial_future = pool.submit(call_safe, extract_financial_summary, yf.Ticker(symbol), [])
+        news_future = pool.submit(call_safe, extract_news, yf.Ticker(symbol), [])
+        info = info_future.result()
+        fast_info = fast_info_future.result()
+        history = history_future.result()
+        if financial_future is not None:
+            financial_summary = financial_future.result()
+            financial_fetched_at = utc_now_iso()
+        news = news_future.result()
+        margin_future.result()
+
     history_fallback = get_history_fallback_prices(history)
     price_history = store_and_load_candles(symbol, history)
 
     overview = build_overview(info, fast_info, history_fallback)
-    valuation = {key: info.get(field) for key, field in VALUATION_FIELDS.items()}
-    profitability = {key: info.get(field) for key, field in PROFITABILITY_FIELDS.items()}
-    analyst = {key: info.get(field) for key, field in ANALYST_FIELDS.items()}
+    valuation = {key: info.get(key) for key in VALUATION_FIELDS}
+    profitability = {key: info.get(key) for key in PROFITABILITY_FIELDS}
+    analyst = {key: info.get(key) for key in ANALYST_FIELDS}
 
     free_cashflow = to_float(info.get("freeCashflow"))
     total_revenue = to_float(info.get("totalRevenue"))
-    profitability["fcfMargin"] = (free_cashflow / total_revenue) if free_cashflow and total_revenue else None
+    # FCF が 0 やマイナスでも売上があれば比率を出す（0 を欠損扱いにしない）。売上 0 / 欠損は None
+    profitability["fcfMargin"] = (free_cashflow / total_revenue) if free_cashflow is not None and total_revenue else None
 
     payload = {
         "ticker": symbol,
@@ -325,12 +431,12 @@ def build_payload(symbol: str):
         "valuation": valuation,
         "profitability": profitability,
         "analyst": analyst,
-        "financialSummary": extract_financial_summary(ticker),
-        "news": extract_news(ticker),
+        "financialSummary": financial_summary,
+        "financialSummaryFetchedAt": financial_fetched_at,
+        "news": news,
         "priceHistory": price_history,
     }
     store_review_snapshot(symbol, payload)
-    fetch_margin.ingest_safely(symbol)
     payload["marginHistory"] = fetch_margin.load_margin_history(symbol)
     return payload
 
@@ -342,8 +448,7 @@ def main():
 
     price_history_only = len(sys.argv) > 2 and sys.argv[2] == "--price-history"
     result = refresh_price_history(symbol) if price_history_only else build_payload(symbol)
-    payload = json.dumps(result, ensure_ascii=False)
-    sys.stdout.buffer.write(payload.encode("utf-8"))
+    sys.stdout.buffer.write(dumps_json_bytes(result))
     return 0
 
 
@@ -1,8 +1,26 @@
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import yfinance as yf
 
+from shared import yahoo_limiter
+
+# Yahoo への同時問い合わせ数の上限（多すぎるとレート制限で失敗が増える）
+MAX_WORKERS = 4
+
+
+def fetch_sector(ticker):
+    yahoo_limiter.acquire()
+    try:
+        info = yf.Ticker(ticker).info
+        return {
+            "sector": str(info.get("sector") or "").strip(),
+            "industry": str(info.get("industry") or "").strip(),
+        }, None
+    except Exception as exc:
+        return None, str(exc)
+
 
 def main():
     payload = json.loads(sys.stdin.read() or "{}")
@@ -10,20 +28,16 @@ def main():
     results = {}
     errors = {}
 
-    seen = set()
-    for raw_ticker in tickers:
-        ticker = str(raw_ticker or "").strip()
-        if not ticker or ticker in seen:
-            continue
-        seen.add(ticker)
-        try:
-            info = yf.Ticker(ticker).info
-            results[ticker] = {
-                "sector": str(info.get("sector") or "").strip(),
-                "industry": str(info.get("industry") or "").strip(),
-            }
-        except Exception as exc:
-            errors[ticker] = str(exc)
+    unique = list(dict.fromkeys(
+        ticker for ticker in (str(raw or "").strip() for raw in tickers) if ticker
+    ))
+    # 銘柄ごとの info 取得は HTTP 待ちが大半なので、上限付きで並行に取得する（結果は入力順）
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for ticker, (result, error) in zip(unique, pool.map(fetch_sector, unique)):
+            if error is None:
+                results[ticker] = result
+            else:
+                errors[ticker] = error
 
     print(json.dumps({"sectors": results, "errors": errors}, ensure_ascii=False))
     return 0
@@ -23,10 +23,11 @@ _HEADERS = {
     "Accept": "application/vnd.github+json",
 }
 _CHUNK = 256 * 1024
+_BUILD_NUMBER = re.compile(r"b(\d+)")
 
 
 def _build_number(name: str) -> int:
-    match = re.search(r"b(\d+)", name or "")
+    match = _BUILD_NUMBER.search(name or "")
     return int(match.group(1)) if match else 0
 
 
@@ -53,27 +54,34 @@ def get_local_status() -> dict:
     }
 
 
-def _variant_label(asset_name: str) -> str:
+_CUDA_VERSION = re.compile(r"cuda-(\d+\.\d+)")
+_OPENVINO_VERSION = re.compile(r"openvino-([\d.]+)")
+
+# アセット名（小文字）に含まれるキーワード -> 表示名と並び順。上から順に照合し、最初に一致した行を使う。
+# (キーワード, 表示名, バージョン付き表示名, バージョン抽出パターン, 並び順)
+_VARIANT_TABLE = (
+    (("cpu",), "CPU", None, None, 0),
+    (("cuda",), "CUDA (NVIDIA)", "CUDA {} (NVIDIA)", _CUDA_VERSION, 1),
+    (("vulkan",), "Vulkan (汎用GPU)", None, None, 2),
+    (("hip", "radeon"), "HIP / ROCm (AMD)", None, None, 3),
+    (("sycl",), "SYCL (Intel)", None, None, 3),
+    (("openvino",), "OpenVINO (Intel)", "OpenVINO {} (Intel)", _OPENVINO_VERSION, 3),
+)
+_OTHER_VARIANT_ORDER = 3
+
+
+def _classify_variant(asset_name: str) -> tuple[str, int]:
+    """アセット名から (表示名, 並び順) を返す。並び順は CPU, CUDA, Vulkan, その他。"""
     low = asset_name.lower()
-    if "cpu" in low:
-        return "CPU"
-    if "cuda" in low:
-        match = re.search(r"cuda-(\d+\.\d+)", low)
-        return f"CUDA {match.group(1)} (NVIDIA)" if match else "CUDA (NVIDIA)"
-    if "vulkan" in low:
-        return "Vulkan (汎用GPU)"
-    if "hip" in low or "radeon" in low:
-        return "HIP / ROCm (AMD)"
-    if "sycl" in low:
-        return "SYCL (Intel)"
-    if "openvino" in low:
-        match = re.search(r"openvino-([\d.]+)", low)
-        return f"OpenVINO {match.group(1)} (Intel)" if match else "OpenVINO (Intel)"
-    return asset_name
+    for keywords, label, versioned_label, version_pattern, order in _VARIANT_TABLE:
+        if any(keyword in low for keyword in keywords):
+            match = version_pattern.search(low) if version_pattern else None
+            return (versioned_label.format(match.group(1)) if match else label), order
+    return asset_name, _OTHER_VARIANT_ORDER
 
 
 def _cuda_version(asset_name: str) -> str:
-    match = re.search(r"cuda-(\d+\.\d+)", asset_name.lower())
+    match = _CUDA_VERSION.search(asset_name.lower())
     return match.group(1) if match else ""
 
 
@@ -90,15 +98,18 @@ def fetch_latest_release() -> dict:
     assets = data.get("assets", [])
 
     variants = []
+    variant_order = {}
     cudart = {}
     for asset in assets:
         name = str(asset.get("name") or "")
         low = name.lower()
         url = asset.get("browser_download_url") or ""
         if low.startswith("llama-") and "bin-win-" in low and low.endswith("x64.zip"):
+            label, order = _classify_variant(name)
+            variant_order[name] = order
             variants.append({
                 "asset_name": name,
-                "label": _variant_label(name),
+                "label": label,
                 "size": int(asset.get("size") or 0),
                 "url": url,
             })
@@ -108,17 +119,7 @@ def fetch_latest_release() -> dict:
                 cudart[version] = {"asset_name": name, "url": url, "size": int(asset.get("size") or 0)}
 
     # Stable ordering: CPU, CUDA (ascending), Vulkan, others.
-    def sort_key(variant):
-        label = variant["label"]
-        if label == "CPU":
-            return (0, "")
-        if label.startswith("CUDA"):
-            return (1, label)
-        if label.startswith("Vulkan"):
-            return (2, "")
-        return (3, label)
-
-    variants.sort(key=sort_key)
+    variants.sort(key=lambda variant: (variant_order[variant["asset_name"]], variant["label"]))
 
     local = get_local_status()
     return {
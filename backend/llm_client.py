@@ -37,6 +37,8 @@ def chat_stream(
         "stream": True,
         "stream_options": {"include_usage": True},
         "max_tokens": max_tokens,
+        # 前回と共通する先頭（固定の system プロンプトや履歴）の KV を再利用し、prefill を省く
+        "cache_prompt": True,
         **DEFAULT_SAMPLING,
     }
     if tools:
@@ -51,7 +53,8 @@ def chat_stream(
         method="POST",
     )
 
-    # ストリーミングのツール呼び出し断片は index ごとに name / arguments を連結して復元する
+    # ストリーミングのツール呼び出し断片は index ごとに name / arguments を集め、最後に連結して復元する
+    # （dict に入れた文字列への += は断片ごとに全体をコピーし直すため、長い arguments ほど遅くなる）
     tool_calls: list[dict] = []
     usage: dict = {}
     timings: dict = {}
@@ -90,17 +93,15 @@ def chat_stream(
                 for tc in delta.get("tool_calls") or []:
                     index = tc.get("index", 0)
                     while len(tool_calls) <= index:
-                        tool_calls.append(
-                            {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
-                        )
+                        tool_calls.append({"id": "", "name": [], "arguments": []})
                     slot = tool_calls[index]
                     if tc.get("id"):
                         slot["id"] = tc["id"]
                     fn = tc.get("function") or {}
                     if fn.get("name"):
-                        slot["function"]["name"] += fn["name"]
+                        slot["name"].append(fn["name"])
                     if fn.get("arguments"):
-                        slot["function"]["arguments"] += fn["arguments"]
+                        slot["arguments"].append(fn["arguments"])
     except urllib_error.HTTPError as e:
         body = ""
         try:
@@ -111,7 +112,17 @@ def chat_stream(
         raise RuntimeError(f"llama-server {e.code}: {body}") from e
 
     if tool_calls:
-        yield ("tool_calls", tool_calls)
+        yield (
+            "tool_calls",
+            [
+                {
+                    "id": slot["id"],
+                    "type": "function",
+                    "function": {"name": "".join(slot["name"]), "arguments": "".join(slot["arguments"])},
+                }
+                for slot in tool_calls
+            ],
+        )
 
     elapsed = max(0.0, time.perf_counter() - started_at)
     completion_tokens = usage.get("completion_tokens")
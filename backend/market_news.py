@@ -3,17 +3,20 @@
 ddgs のニュース検索を市況クエリ数本で束ね、`app.db` の `market_news` テーブルへ
 蓄積する（URL主キーでupsert）。再検索のたびに一覧が入れ替わるのではなく、
 新着が既存の蓄積へ追加され、古いものから RETENTION_ITEMS 件を超えた分だけ削除される。
-アプリ再起動後も蓄積は残る。検索の実行間隔はメモリ上のTTLで制御する。
+アプリ再起動後も蓄積は残る。検索の実行間隔はメモリ上のTTLで制御し、再起動直後は
+蓄積の最終取得時刻から経過時間を復元する（起動のたびに再検索しない）。
 LLM は使わない（まとめ生成は chat_server 側の /market/summary が担当）。
 """
 from __future__ import annotations
 
+import calendar
 import sqlite3
 import threading
 import time
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 
 from paths import DB_FILE
+from shared import utc_now_iso
 from search_web import search_news
 
 QUERIES = ["株式市場", "日経平均", "米国株", "為替 ドル円"]
@@ -22,8 +25,21 @@ RETENTION_ITEMS = 100  # DBに残す最大件数（古い日付から削除）
 RESPONSE_ITEMS = 40    # APIが返す最大件数
 CACHE_TTL_SECONDS = 15 * 60
 
+
+class _FetchState:
+    """最後に検索した時刻（表示用の ISO 文字列と、TTL 判定用の monotonic 秒）。"""
+
+    __slots__ = ("fetched_at", "fetched_monotonic", "restored")
+
+    def __init__(self) -> None:
+        self.fetched_at: str | None = None
+        self.fetched_monotonic = 0.0
+        self.restored = False
+
+
 _lock = threading.Lock()
-_state = {"fetchedAt": None, "fetched_monotonic": 0.0}
+_state = _FetchState()
+_digest_cache: tuple[str | None, str] = (None, "")  # (fetchedAt, 見出し一覧テキスト)
 
 
 def _connect() -> sqlite3.Connection:
@@ -43,15 +59,19 @@ def _connect() -> sqlite3.Connection:
     return conn
 
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+def _search_query(query: str) -> list[dict]:
+    return search_news(query, max_results=MAX_PER_QUERY, include_image=True)
 
 
 def _fetch_items() -> list[dict]:
+    # クエリごとの検索は待ち時間が大半なので並行に投げ、重複除去は QUERIES の順で行う
+    # （同じ記事が複数クエリに出たときの query の付き方を逐次実行と同じに保つ）
+    with ThreadPoolExecutor(max_workers=len(QUERIES)) as pool:
+        results = list(pool.map(_search_query, QUERIES))
     items: list[dict] = []
     seen: set[str] = set()
-    for query in QUERIES:
-        for item in search_news(query, max_results=MAX_PER_QUERY, include_image=True):
+    for query, found in zip(QUERIES, results):
+        for item in found:
             url = str(item.get("url") or "")
             if not url or url in seen:
                 continue
@@ -66,7 +86,7 @@ def _store_items(items: list[dict]) -> None:
         return
     conn = _connect()
     try:
-        now = _now_iso()
+        now = utc_now_iso()
         conn.executemany(
             """INSERT INTO market_news (url, title, snippet, source, image, published_at, query, fetched_at)
                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -108,6 +128,28 @@ def _load_items(limit: int = RESPONSE_ITEMS) -> list[dict]:
     ]
 
 
+def _restore_state() -> None:
+    """プロセス起動後の初回だけ、蓄積の最終取得時刻から前回検索の経過時間を復元する。
+
+    fetched_at は新着を追加した時刻なので、新着の無かった検索は数えない（実際より古く見積もる側に倒れる）。
+    """
+    _state.restored = True
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT MAX(fetched_at) FROM market_news").fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0]:
+        return
+    try:
+        fetched_epoch = calendar.timegm(time.strptime(row[0], "%Y-%m-%dT%H:%M:%SZ"))
+    except ValueError:
+        return
+    age = max(time.time() - fetched_epoch, 0.0)
+    _state.fetched_at = row[0]
+    _state.fetched_monotonic = time.monotonic() - age
+
+
 def get_news(force: bool = False) -> dict:
     """蓄積済みニュースを返す。TTLが切れていれば再検索して蓄積に追加する。
 
@@ -115,15 +157,39 @@ def get_news(force: bool = False) -> dict:
     表示中のニュースが消えることはない。
     """
     with _lock:
-        age = time.monotonic() - _state["fetched_monotonic"]
-        if force or not _state["fetchedAt"] or age >= CACHE_TTL_SECONDS:
+        if not _state.restored:
+            _restore_state()
+        age = time.monotonic() - _state.fetched_monotonic
+        if force or not _state.fetched_at or age >= CACHE_TTL_SECONDS:
             items = _fetch_items()
             if items:
                 _store_items(items)
-                _state["fetchedAt"] = _now_iso()
-                _state["fetched_monotonic"] = time.monotonic()
+                _state.fetched_at = utc_now_iso()
+                _state.fetched_monotonic = time.monotonic()
         return {
             "items": _load_items(),
-            "fetchedAt": _state["fetchedAt"],
+            "fetchedAt": _state.fetched_at,
             "cached": not force and age < CACHE_TTL_SECONDS,
         }
+
+
+def _headline_line(item: dict) -> str:
+    date = str(item.get("date") or "")[:10]
+    source = str(item.get("source") or "")
+    meta = "・".join(part for part in (source, date) if part)
+    snippet = str(item.get("snippet") or "")[:80]
+    return f"- {item.get('title')}{f'（{meta}）' if meta else ''} {snippet}".rstrip()
+
+
+def headline_digest(news: dict) -> str:
+    """get_news の結果を、まとめ生成に渡す見出し一覧（1件1行）にする。
+
+    一覧は検索（fetchedAt）が変わるまで同じなので、整形結果を fetchedAt ごとに使い回す。
+    """
+    global _digest_cache
+    fetched_at = news.get("fetchedAt")
+    if fetched_at and _digest_cache[0] == fetched_at:
+        return _digest_cache[1]
+    digest = "\n".join(_headline_line(item) for item in news.get("items") or [])
+    _digest_cache = (fetched_at, digest)
+    return digest
@@ -2,17 +2,31 @@ import bisect
 import json
 import sqlite3
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
-import yfinance as yf
-
-from shared import FX_TICKERS, convert_to_jpy, get_yf_price, normalize_price_currency
+from shared import FX_TICKERS, convert_to_jpy, get_fx_rate, get_yf_price, loads_json, normalize_price_currency, to_float, utc_now_iso, yahoo_limiter
 from paths import DATA_DIR, DB_FILE, PORTFOLIO_FILE, STOCK_MASTER_FILE
 
+# 前回 stocks へ取り込んだ銘柄マスターの (更新時刻, サイズ)。一致すれば再取り込みを省略する。
+MASTER_SIGNATURE_KEY = "stock_master_signature"
+# ensure_schema の内容（テーブル・列・移行処理）を変えたら1つ上げる。
+# 適用済みの DB は PRAGMA user_version で判定し、毎回の CREATE / 列確認を省略する。
+SCHEMA_VERSION = 1
+# refresh で Yahoo へ同時に問い合わせる銘柄数の上限（多すぎるとレート制限で失敗が増える）
+MAX_FETCH_WORKERS = 4
+
+# (通貨, 期間) -> (日次レート, 昇順の日付)。プロセスは操作ごとに起動されるため、保持は1回の実行内に限られる。
+_fx_history_cache: dict[tuple[str, str], tuple[dict[str, float], list[str]]] = {}
+_fx_history_inflight: dict[tuple[str, str], Future] = {}  # (通貨, 期間) -> 取得中の結果
+_fx_history_lock = threading.Lock()
+
 
 def utc_now() -> str:
-    return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    return utc_now_iso()
 
 
 def today_iso() -> str:
@@ -41,7 +55,17 @@ def ensure_data_dir() -> None:
 def load_json(path: Path, fallback):
     if not path.exists():
         return fallback
-    return json.loads(path.read_text(encoding="utf-8"))
+    # バイト列のまま渡す（文字列へのデコードを挟まない。UTF-8 の BOM 付きも読める）
+    return loads_json(path.read_bytes())
+
+
+@lru_cache(maxsize=1)
+def load_stock_master() -> dict:
+    """銘柄マスター（ticker -> 銘柄名）。1プロセス内では変わらないため初回の読み込みを使い回す。
+
+    呼び出し側で書き換えないこと（キャッシュ本体を共有している）。
+    """
+    return load_json(STOCK_MASTER_FILE, {})
 
 
 def connect_db() -> sqlite3.Connection:
@@ -57,6 +81,8 @@ def connect_db() -> sqlite3.Connection:
 
 
 def ensure_schema(conn: sqlite3.Connection) -> None:
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
     conn.executescript(
         """
         CREATE TABLE IF NOT EXISTS stocks (
@@ -139,6 +165,7 @@ def ensure_schema(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE watchlist ADD COLUMN sort_order INTEGER NOT NULL DEFAULT 0")
     if "category" not in watchlist_columns:
         conn.execute("ALTER TABLE watchlist ADD COLUMN category TEXT NOT NULL DEFAULT ''")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
 
 
@@ -176,9 +203,22 @@ def _migrate_holdings_to_lots(conn: sqlite3.Connection) -> None:
         conn.execute("PRAGMA foreign_keys = ON")
 
 
+def _stock_master_signature() -> str:
+    try:
+        stat = STOCK_MASTER_FILE.stat()
+    except OSError:
+        return ""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
 def seed_stocks_from_master(conn: sqlite3.Connection) -> None:
+    # 毎回のプロセス起動で約4,000行を upsert していたため、マスターが前回取り込み時から
+    # 変わっていなければ（更新時刻・サイズが一致）パース・書き込みごと省略する。
+    signature = _stock_master_signature()
+    if not signature or get_setting(conn, MASTER_SIGNATURE_KEY) == signature:
+        return
     now = utc_now()
-    master = load_json(STOCK_MASTER_FILE, {})
+    master = load_stock_master()
     rows = [
         (ticker, str(name or "").strip(), now, now)
         for ticker, name in master.items()
@@ -199,22 +239,30 @@ def seed_stocks_from_master(conn: sqlite3.Connection) -> None:
         """,
         rows,
     )
+    set_setting(conn, MASTER_SIGNATURE_KEY, signature)
     conn.commit()
 
 
 def ensure_stock(conn: sqlite3.Connection, ticker: str) -> None:
-    normalized = str(ticker or "").strip()
-    if not normalized:
+    ensure_stocks(conn, [ticker])
+
+
+def ensure_stocks(conn: sqlite3.Connection, tickers) -> None:
+    """stocks に銘柄行を用意する（既存なら updated_at のみ更新）。複数銘柄は1回の executemany で書く。"""
+    normalized_tickers = list(dict.fromkeys(
+        normalized for normalized in (str(ticker or "").strip() for ticker in tickers) if normalized
+    ))
+    if not normalized_tickers:
         return
-    name = load_json(STOCK_MASTER_FILE, {}).get(normalized, normalized)
+    master = load_stock_master()
     now = utc_now()
-    conn.execute(
+    conn.executemany(
         """
         INSERT INTO stocks (ticker, name, created_at, updated_at)
         VALUES (?, ?, ?, ?)
         ON CONFLICT(ticker) DO UPDATE SET updated_at = excluded.updated_at
         """,
-        (normalized, name, now, now),
+        [(ticker, master.get(ticker, ticker), now, now) for ticker in normalized_tickers],
     )
 
 
@@ -364,24 +412,63 @@ def initialize() -> sqlite3.Connection:
     return conn
 
 
-def get_fx_history(currency: str, period: str = "1y") -> dict[str, float]:
+def get_fx_history(currency: str, period: str = "1y") -> tuple[dict[str, float], list[str]]:
+    """通貨の日次対円レート ({日付: 終値}, 昇順の日付リスト)。同じ実行内では通貨・期間ごとに1回だけ取得する。
+
+    refresh では同じ通貨の銘柄が並行に履歴を取りに来るため、取得中の通貨は後続のスレッドが
+    その結果を待って共有する（欠損日の補間に使う日付の並べ替えも1回で済む）。ロックは辞書の
+    参照・登録の間だけ握り、別の通貨の取得は並行に進める。
+    返す dict / list は共有されるため、呼び出し側で変更しないこと。
+    """
     normalized = (currency or "JPY").upper()
     if normalized == "JPY":
-        return {}
+        return {}, []
     fx_ticker = FX_TICKERS.get(normalized)
     if not fx_ticker:
         raise ValueError(f"Unsupported currency: {normalized}")
 
+    key = (normalized, period)
+    with _fx_history_lock:
+        cached = _fx_history_cache.get(key)
+        if cached is not None:
+            return cached
+        pending = _fx_history_inflight.get(key)
+        if pending is None:
+            future = _fx_history_inflight[key] = Future()
+    if pending is not None:
+        return pending.result()
+
+    try:
+        fx_map = _download_fx_history(normalized, fx_ticker, period)
+        result = (fx_map, sorted(fx_map))
+    except BaseException as exc:
+        # 失敗は保持しない（待っていたスレッドには同じ例外を返し、次の呼び出しで取り直す）
+        with _fx_history_lock:
+            _fx_history_inflight.pop(key, None)
+        future.set_exception(exc)
+        raise
+    with _fx_history_lock:
+        _fx_history_inflight.pop(key, None)
+        _fx_history_cache[key] = result
+    future.set_result(result)
+    return result
+
+
+def _download_fx_history(currency: str, fx_ticker: str, period: str) -> dict[str, float]:
+    import yfinance as yf  # 重い依存のため遅延 import（load / save / history では使わない）
+
     history = yf.Ticker(fx_ticker).history(period=period, interval="1d", auto_adjust=False)
     if history.empty:
-        raise ValueError(f"No FX history for {normalized}")
+        raise ValueError(f"No FX history for {currency}")
 
+    # iterrows は1行ごとに Series を組み立てて遅いため、日付と終値を列ごとに list へ取り出して zip する
+    if "Close" not in history:
+        return {}
     fx_map = {}
-    for index, row in history.iterrows():
-        close_price = row.get("Close")
-        if close_price is None:
-            continue
-        fx_map[index.date().isoformat()] = float(close_price)
+    for trade_date, close_price in zip(history.index.strftime("%Y-%m-%d"), history["Close"].tolist()):
+        close_price = to_float(close_price)
+        if close_price is not None:
+            fx_map[trade_date] = close_price
     return fx_map
 
 
@@ -395,12 +482,14 @@ def _fx_rate_for_date(fx_map: dict[str, float], sorted_dates: list[str], trade_d
     return float(fx_map[sorted_dates[0]])
 
 
-def store_price_history(conn: sqlite3.Connection, ticker: str, period: str = "1y") -> int:
-    normalized = str(ticker or "").strip()
-    if not normalized:
-        return 0
-    ensure_stock(conn, normalized)
-    stock = yf.Ticker(normalized)
+def fetch_price_history(ticker: str, period: str = "1y") -> list[tuple]:
+    """Yahoo から日足終値を取得し、price_history に書く行 (trade_date, 円換算終値, 現地終値, 通貨) にする。
+
+    DB には触れないため、複数銘柄をスレッドで並行に取得できる。
+    """
+    import yfinance as yf  # 重い依存のため遅延 import
+
+    stock = yf.Ticker(ticker)
     history = stock.history(period=period, interval="1d", auto_adjust=False)
     if history.empty:
         raise ValueError("No historical data returned")
@@ -408,67 +497,84 @@ def store_price_history(conn: sqlite3.Connection, ticker: str, period: str = "1y
     raw_currency = stock.fast_info.get("currency")
     if not raw_currency:
         # 通貨を推測して換算すると履歴が桁ごと壊れるため、明示的にエラーにする。
-        raise ValueError(f"{normalized}: currency unavailable from Yahoo")
+        raise ValueError(f"{ticker}: currency unavailable from Yahoo")
     _, currency = normalize_price_currency(None, raw_currency)
-    fx_map = get_fx_history(currency, period=period) if currency != "JPY" else {}
-    fx_dates = sorted(fx_map)
-    inserted = 0
+    fx_map, fx_dates = get_fx_history(currency, period=period)
+    rows = []
 
-    for index, row in history.iterrows():
-        raw_close = row.get("Close")
+    closes = history["Close"].tolist() if "Close" in history else []
+    for trade_date, raw_close in zip(history.index.strftime("%Y-%m-%d"), closes):
+        raw_close = to_float(raw_close)
         if raw_close is None:
             continue
-        close_price, _ = normalize_price_currency(float(raw_close), raw_currency)
-        trade_date = index.date().isoformat()
+        close_price, _ = normalize_price_currency(raw_close, raw_currency)
         if currency == "JPY":
             price_jpy = close_price
         else:
             price_jpy = close_price * _fx_rate_for_date(fx_map, fx_dates, trade_date)
-        conn.execute(
-            """
-            INSERT OR REPLACE INTO price_history (ticker, trade_date, close_price_jpy, source_close, currency)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (normalized, trade_date, int(round(price_jpy)), close_price, currency),
-        )
-        inserted += 1
+        rows.append((trade_date, int(round(price_jpy)), close_price, currency))
+    return rows
+
 
+def write_price_history(conn: sqlite3.Connection, ticker: str, rows: list[tuple]) -> int:
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO price_history (ticker, trade_date, close_price_jpy, source_close, currency)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(ticker, trade_date, price_jpy, close_price, currency)
+         for trade_date, price_jpy, close_price, currency in rows],
+    )
     conn.commit()
-    return inserted
+    return len(rows)
+
+
+def store_price_history(conn: sqlite3.Connection, ticker: str, period: str = "1y") -> int:
+    normalized = str(ticker or "").strip()
+    if not normalized:
+        return 0
+    ensure_stock(conn, normalized)
+    return write_price_history(conn, normalized, fetch_price_history(normalized, period=period))
 
 
 def _build_history_from_rows(holdings: list[dict[str, object]], rows) -> list[dict[str, object]]:
-    """Compute portfolio value time series from normalized holdings and price_history rows."""
-    history_by_ticker: dict[str, dict[str, int]] = {}
-    all_dates: set[str] = set()
-    for row in rows:
-        trade_date = row["trade_date"]
-        history_by_ticker.setdefault(row["ticker"], {})[trade_date] = int(row["close_price_jpy"])
-        all_dates.add(trade_date)
+    """Compute portfolio value time series from normalized holdings and price_history rows.
 
-    if not all_dates:
-        return []
+    rows は trade_date 昇順であること。日付ごとに全保有を掛け直さず、価格が変わった
+    銘柄の差分だけ評価額へ足し込む（日付数 × 保有数ではなく行数に比例）。
+    """
+    # 同一銘柄の複数ロットは株数を合算しておけば評価額は変わらない
+    shares_by_ticker: dict[str, int] = {}
+    for h in holdings:
+        shares_by_ticker[h["ticker"]] = shares_by_ticker.get(h["ticker"], 0) + h["shares"]
 
     running_prices: dict[str, int] = {}
+    missing = len(shares_by_ticker)
+    total_value = 0
+    current_date = None
     result = []
-    for trade_date in sorted(all_dates):
-        for h in holdings:
-            price = history_by_ticker.get(h["ticker"], {}).get(trade_date)
-            if price is not None:
-                running_prices[h["ticker"]] = price
-
-        total_value = 0
-        complete = True
-        for h in holdings:
-            price = running_prices.get(h["ticker"])
-            if price is None:
-                complete = False
-                break
-            total_value += h["shares"] * price
-
-        if complete:
-            result.append({"date": trade_date, "value": total_value})
+    for row in rows:
+        trade_date = row["trade_date"]
+        if trade_date != current_date:
+            # 全銘柄の価格が一度でも揃った日以降だけを系列に含める
+            if current_date is not None and missing == 0:
+                result.append({"date": current_date, "value": total_value})
+            current_date = trade_date
+        ticker = row["ticker"]
+        shares = shares_by_ticker.get(ticker)
+        if shares is None:
+            continue
+        price = int(row["close_price_jpy"])
+        previous = running_prices.get(ticker)
+        if previous is None:
+            missing -= 1
+            total_value += shares * price
+        else:
+            total_value += shares * (price - previous)
+        running_prices[ticker] = price
 
+    if current_date is not None and missing == 0:
+        result.append({"date": current_date, "value": total_value})
     return result
 
 
@@ -496,23 +602,22 @@ def build_portfolio_history_for_holdings(conn: sqlite3.Connection, holdings: lis
     return _build_history_from_rows(normalized, rows)
 
 
-def store_latest_quote(conn: sqlite3.Connection, ticker: str) -> dict[str, object]:
-    normalized = str(ticker or "").strip()
-    if not normalized:
-        raise ValueError("Ticker is empty")
-    ensure_stock(conn, normalized)
-    price, previous_close, currency = get_yf_price(normalized, require_currency=True)
-    if currency == "JPY":
-        fx_rate = 1.0
-    else:
-        fx_ticker = FX_TICKERS.get(currency)
-        if not fx_ticker:
-            raise ValueError(f"Unsupported currency: {currency}")
-        fx_rate, _, _ = get_yf_price(fx_ticker)
-    price_jpy = price * fx_rate
-    previous_close_jpy = previous_close * fx_rate
-    now = utc_now()
-    quote_date = today_iso()
+def fetch_latest_quote(ticker: str) -> dict[str, object]:
+    """Yahoo から現在値・前日終値を取得して円換算する（DB には触れない）。"""
+    price, previous_close, currency = get_yf_price(ticker, require_currency=True)
+    fx_rate = get_fx_rate(currency)
+    return {
+        "price": float(price),
+        "previous_close": float(previous_close),
+        "currency": currency,
+        "price_jpy": float(price * fx_rate),
+        "previous_close_jpy": float(previous_close * fx_rate),
+        "fx_rate_jpy": float(fx_rate),
+        "quote_date": today_iso(),
+    }
+
+
+def write_latest_quote(conn: sqlite3.Connection, ticker: str, quote: dict[str, object]) -> dict[str, object]:
     conn.execute(
         """
         INSERT INTO latest_quotes (
@@ -531,27 +636,27 @@ def store_latest_quote(conn: sqlite3.Connection, ticker: str) -> dict[str, objec
             updated_at = excluded.updated_at
         """,
         (
-            normalized,
-            int(round(price_jpy)),
-            float(price),
-            currency,
-            float(fx_rate),
-            int(round(previous_close_jpy)),
-            float(previous_close),
-            quote_date,
-            now,
+            ticker,
+            int(round(quote["price_jpy"])),
+            quote["price"],
+            quote["currency"],
+            quote["fx_rate_jpy"],
+            int(round(quote["previous_close_jpy"])),
+            quote["previous_close"],
+            quote["quote_date"],
+            utc_now(),
         ),
     )
     conn.commit()
-    return {
-        "price": float(price),
-        "previous_close": float(previous_close),
-        "currency": currency,
-        "price_jpy": float(price_jpy),
-        "previous_close_jpy": float(previous_close_jpy),
-        "fx_rate_jpy": float(fx_rate),
-        "quote_date": quote_date,
-    }
+    return quote
+
+
+def store_latest_quote(conn: sqlite3.Connection, ticker: str) -> dict[str, object]:
+    normalized = str(ticker or "").strip()
+    if not normalized:
+        raise ValueError("Ticker is empty")
+    ensure_stock(conn, normalized)
+    return write_latest_quote(conn, normalized, fetch_latest_quote(normalized))
 
 
 def build_portfolio_history(conn: sqlite3.Connection) -> list[dict[str, object]]:
@@ -641,89 +746,97 @@ def save_state(conn: sqlite3.Connection, payload: dict[str, object]) -> dict[str
     if "watchlistCategories" in payload:
         set_watchlist_categories(conn, payload.get("watchlistCategories"))
 
-    # 保存は全量置き換え。同一銘柄の複数ロットを行単位で保持する。
-    conn.execute("DELETE FROM holdings")
+    # 行はまず組み立ててから、テーブルごとに executemany でまとめて書く
+    holding_rows = []
+    quote_rows = []
+    today = today_iso()
     for index, holding in enumerate(holdings):
         ticker = str(holding.get("ticker") or "").strip()
         if not ticker:
             continue
-        ensure_stock(conn, ticker)
-        conn.execute(
-            """
-            INSERT INTO holdings (ticker, shares, buy_price, note, sort_order, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (
-                ticker,
-                parse_number(holding.get("shares")),
-                parse_number(holding.get("buyPrice")),
-                sanitize_text(holding.get("note")),
-                index,
-                now,
-            ),
-        )
-
+        holding_rows.append((
+            ticker,
+            parse_number(holding.get("shares")),
+            parse_number(holding.get("buyPrice")),
+            sanitize_text(holding.get("note")),
+            index,
+            now,
+        ))
         price_jpy = parse_number(holding.get("price"))
         if price_jpy > 0:
-            conn.execute(
-                """
-                INSERT INTO latest_quotes (
-                    ticker, price_jpy, source_price, currency, fx_rate_jpy,
-                    previous_close_jpy, previous_close_source, quote_date, updated_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(ticker) DO UPDATE SET
-                    price_jpy = excluded.price_jpy,
-                    source_price = excluded.source_price,
-                    currency = excluded.currency,
-                    fx_rate_jpy = excluded.fx_rate_jpy,
-                    previous_close_jpy = excluded.previous_close_jpy,
-                    previous_close_source = excluded.previous_close_source,
-                    quote_date = excluded.quote_date,
-                    updated_at = excluded.updated_at
-                """,
-                (
-                    ticker,
-                    price_jpy,
-                    holding.get("sourcePrice"),
-                    sanitize_text(holding.get("currency") or "JPY").upper(),
-                    None,
-                    parse_number(holding.get("previousClose")),
-                    holding.get("sourcePreviousClose"),
-                    today_iso(),
-                    now,
-                ),
-            )
+            quote_rows.append((
+                ticker,
+                price_jpy,
+                holding.get("sourcePrice"),
+                sanitize_text(holding.get("currency") or "JPY").upper(),
+                None,
+                parse_number(holding.get("previousClose")),
+                holding.get("sourcePreviousClose"),
+                today,
+                now,
+            ))
 
     incoming_watchlist_tickers = []
+    watchlist_rows = []
     for index, item in enumerate(watchlist):
         ticker = str(item.get("ticker") or "").strip()
         if not ticker:
             continue
         incoming_watchlist_tickers.append(ticker)
-        ensure_stock(conn, ticker)
-        conn.execute(
-            """
-            INSERT INTO watchlist (ticker, rating, thesis, risk, category, sort_order, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(ticker) DO UPDATE SET
-                rating = excluded.rating,
-                thesis = excluded.thesis,
-                risk = excluded.risk,
-                category = excluded.category,
-                sort_order = excluded.sort_order,
-                updated_at = excluded.updated_at
-            """,
-            (
-                ticker,
-                sanitize_text(item.get("rating") or "B"),
-                sanitize_text(item.get("thesis")),
-                sanitize_text(item.get("risk")),
-                sanitize_text(item.get("category")).strip(),
-                index,
-                now,
-            ),
+        watchlist_rows.append((
+            ticker,
+            sanitize_text(item.get("rating") or "B"),
+            sanitize_text(item.get("thesis")),
+            sanitize_text(item.get("risk")),
+            sanitize_text(item.get("category")).strip(),
+            index,
+            now,
+        ))
+
+    ensure_stocks(conn, [row[0] for row in holding_rows] + incoming_watchlist_tickers)
+
+    # 保存は全量置き換え。同一銘柄の複数ロットを行単位で保持する。
+    conn.execute("DELETE FROM holdings")
+    conn.executemany(
+        """
+        INSERT INTO holdings (ticker, shares, buy_price, note, sort_order, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        holding_rows,
+    )
+    conn.executemany(
+        """
+        INSERT INTO latest_quotes (
+            ticker, price_jpy, source_price, currency, fx_rate_jpy,
+            previous_close_jpy, previous_close_source, quote_date, updated_at
         )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ticker) DO UPDATE SET
+            price_jpy = excluded.price_jpy,
+            source_price = excluded.source_price,
+            currency = excluded.currency,
+            fx_rate_jpy = excluded.fx_rate_jpy,
+            previous_close_jpy = excluded.previous_close_jpy,
+            previous_close_source = excluded.previous_close_source,
+            quote_date = excluded.quote_date,
+            updated_at = excluded.updated_at
+        """,
+        quote_rows,
+    )
+    conn.executemany(
+        """
+        INSERT INTO watchlist (ticker, rating, thesis, risk, category, sort_order, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ticker) DO UPDATE SET
+            rating = excluded.rating,
+            thesis = excluded.thesis,
+            risk = excluded.risk,
+            category = excluded.category,
+            sort_order = excluded.sort_order,
+            updated_at = excluded.updated_at
+        """,
+        watchlist_rows,
+    )
 
     if incoming_watchlist_tickers:
         placeholders = ",".join("?" for _ in incoming_watchlist_tickers)
@@ -740,28 +853,47 @@ def save_state(conn: sqlite3.Connection, payload: dict[str, object]) -> dict[str
     return state
 
 
+def _fetch_ticker_prices(ticker: str):
+    """(quote, history_rows, quote_error, history_error) を返す。現在値が取れなければ履歴は取りに行かない。"""
+    try:
+        yahoo_limiter.acquire()
+        quote = fetch_latest_quote(ticker)
+    except Exception as exc:
+        return None, None, str(exc), None
+    try:
+        yahoo_limiter.acquire()
+        return quote, fetch_price_history(ticker, period="1y"), None, None
+    except Exception as exc:
+        return quote, None, None, str(exc)
+
+
 def refresh_prices(conn: sqlite3.Connection, tickers: list[str]) -> dict[str, object]:
-    normalized_tickers = []
-    seen = set()
-    for ticker in tickers:
-        normalized = str(ticker or "").strip()
-        if normalized and normalized not in seen:
-            seen.add(normalized)
-            normalized_tickers.append(normalized)
+    # 入力順を保ったまま重複を除く（dict は挿入順を保つ）
+    normalized_tickers = list(dict.fromkeys(
+        normalized for normalized in (str(ticker or "").strip() for ticker in tickers) if normalized
+    ))
 
     quotes = {}
     errors = {}
     history_updates = {}
-    for ticker in normalized_tickers:
-        try:
-            quote = store_latest_quote(conn, ticker)
+    # Yahoo への問い合わせは銘柄ごとに独立した HTTP 待ちなので並行に行い、
+    # SQLite への書き込みは接続を共有しないよう、このスレッドで入力順に行う。
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as pool:
+        fetched = pool.map(_fetch_ticker_prices, normalized_tickers)
+        for ticker, (quote, history_rows, quote_error, history_error) in zip(normalized_tickers, fetched):
+            if quote_error is not None:
+                errors[ticker] = quote_error
+                continue
             try:
-                history_updates[ticker] = store_price_history(conn, ticker, period="1y")
-            except Exception as history_error:
-                errors[f"{ticker}:history"] = str(history_error)
-            quotes[ticker] = quote
-        except Exception as exc:
-            errors[ticker] = str(exc)
+                ensure_stock(conn, ticker)
+                write_latest_quote(conn, ticker, quote)
+                if history_error is None:
+                    history_updates[ticker] = write_price_history(conn, ticker, history_rows)
+                else:
+                    errors[f"{ticker}:history"] = history_error
+                quotes[ticker] = quote
+            except Exception as exc:
+                errors[ticker] = str(exc)
 
     return {
         "quotes": quotes,
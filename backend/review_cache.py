@@ -1,43 +1,59 @@
 """個別銘柄レビューのローカルキャッシュを高速に読み出す。"""
 
-import json
-import re
 import sqlite3
 import sys
 
+from fetch_margin import code_for_ticker
 from paths import DB_FILE
+from shared import dumps_json_bytes, loads_json
 
-# 起動高速化のため fetch_margin（requests 依存）は import せず、
-# 東証ティッカー→コードの変換だけ同じ規則で行う
-TSE_TICKER = re.compile(r"([0-9A-Z]{4,5})\.T$")
 
+def existing_tables(conn) -> set[str]:
+    """読み出しに使うテーブルのうち存在するものを、sqlite_master への1回の問い合わせで返す。"""
+    return {
+        row[0]
+        for row in conn.execute(
+            """SELECT name FROM sqlite_master WHERE type='table'
+               AND name IN ('review_snapshots', 'review_price_history', 'margin_history')"""
+        )
+    }
 
-def load_margin_rows(conn, symbol):
-    match = TSE_TICKER.fullmatch(symbol)
-    if not match:
-        return []
-    table = conn.execute(
-        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='margin_history'"
-    ).fetchone()
-    if not table:
+
+def load_margin_rows(conn, symbol, tables):
+    code = code_for_ticker(symbol)
+    if not code or "margin_history" not in tables:
         return []
     rows = conn.execute(
         """SELECT week_date, sell_balance, buy_balance FROM margin_history
            WHERE code = ? ORDER BY week_date""",
-        (match.group(1),),
+        (code,),
     ).fetchall()
     return [{"date": r[0], "sell": r[1], "buy": r[2]} for r in rows]
 
 
-def load_cached_review(symbol: str):
+def load_candles(conn, symbol):
+    """蓄積済みの日足（OHLC がすべて正の行）を古い順に返す。review_price_history は存在する前提。"""
+    rows = conn.execute(
+        """SELECT trade_date, open, high, low, close, volume
+           FROM review_price_history
+           WHERE ticker = ? AND open > 0 AND high > 0 AND low > 0 AND close > 0
+           ORDER BY trade_date""",
+        (symbol,),
+    ).fetchall()
+    return [
+        {"date": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4], "volume": r[5]}
+        for r in rows
+    ]
+
+
+def _load_review_parts(symbol: str):
+    """スナップショット本体の JSON 文字列と、読み出し時に付け足す項目を返す。無ければ None。"""
     if not DB_FILE.exists():
         return None
     conn = sqlite3.connect(DB_FILE)
     try:
-        table = conn.execute(
-            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='review_snapshots'"
-        ).fetchone()
-        if not table:
+        tables = existing_tables(conn)
+        if "review_snapshots" not in tables:
             return None
         row = conn.execute(
             "SELECT payload_json, updated_at FROM review_snapshots WHERE ticker = ?",
@@ -45,54 +61,55 @@ def load_cached_review(symbol: str):
         ).fetchone()
         if not row:
             return None
-        payload = json.loads(row[0])
-        payload["cachedAt"] = row[1]
-        history_table = conn.execute(
-            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='review_price_history'"
-        ).fetchone()
-        history = []
-        if history_table:
-            history = conn.execute(
-                """SELECT trade_date, open, high, low, close, volume
-                   FROM review_price_history
-                   WHERE ticker = ? AND open > 0 AND high > 0 AND low > 0 AND close > 0
-                   ORDER BY trade_date""",
-                (symbol,),
-            ).fetchall()
-        payload["priceHistory"] = [
-            {"date": item[0], "open": item[1], "high": item[2], "low": item[3],
-             "close": item[4], "volume": item[5]}
-            for item in history
-        ]
-        payload["marginHistory"] = load_margin_rows(conn, symbol)
-        return payload
+        extras = {
+            "cachedAt": row[1],
+            "priceHistory": load_candles(conn, symbol) if "review_price_history" in tables else [],
+            "marginHistory": load_margin_rows(conn, symbol, tables),
+        }
+        return row[0], extras
     finally:
         conn.close()
 
 
+def load_cached_review(symbol: str):
+    parts = _load_review_parts(symbol)
+    if parts is None:
+        return None
+    payload_json, extras = parts
+    payload = loads_json(payload_json)
+    payload.update(extras)
+    return payload
+
+
+def load_cached_review_json(symbol: str) -> bytes:
+    """load_cached_review の結果を JSON バイト列で返す。
+
+    スナップショット本体は解析・再エンコードせず、末尾の } の手前に追加項目を継ぎ足す
+    （本体は大きく、ここでは中身を見る必要が無いため）。本体が JSON オブジェクトでなければ通常どおり組み立てる。
+    """
+    parts = _load_review_parts(symbol)
+    if parts is None:
+        return dumps_json_bytes(None)
+    payload_json, extras = parts
+    body = payload_json.strip()
+    if not (body.startswith("{") and body.endswith("}")):
+        payload = loads_json(payload_json)
+        payload.update(extras)
+        return dumps_json_bytes(payload)
+    head = body[:-1].rstrip()
+    separator = "" if head == "{" else ","
+    return (head + separator).encode("utf-8") + dumps_json_bytes(extras)[1:]
+
+
 def load_price_history_only(symbol: str):
     """スナップショットの有無に関わらず、蓄積済みの日足だけを返す（指数・為替用）。"""
     if not DB_FILE.exists():
         return []
     conn = sqlite3.connect(DB_FILE)
     try:
-        history_table = conn.execute(
-            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='review_price_history'"
-        ).fetchone()
-        if not history_table:
+        if "review_price_history" not in existing_tables(conn):
             return []
-        history = conn.execute(
-            """SELECT trade_date, open, high, low, close, volume
-               FROM review_price_history
-               WHERE ticker = ? AND open > 0 AND high > 0 AND low > 0 AND close > 0
-               ORDER BY trade_date""",
-            (symbol,),
-        ).fetchall()
-        return [
-            {"date": item[0], "open": item[1], "high": item[2], "low": item[3],
-             "close": item[4], "volume": item[5]}
-            for item in history
-        ]
+        return load_candles(conn, symbol)
     finally:
         conn.close()
 
@@ -102,9 +119,10 @@ def main():
     if not symbol:
         raise SystemExit("Ticker is required")
     history_only = len(sys.argv) > 2 and sys.argv[2] == "--history-only"
-    result = load_price_history_only(symbol) if history_only else load_cached_review(symbol)
-    output = json.dumps(result, ensure_ascii=False)
-    sys.stdout.buffer.write(output.encode("utf-8"))
+    if history_only:
+        sys.stdout.buffer.write(dumps_json_bytes(load_price_history_only(symbol)))
+    else:
+        sys.stdout.buffer.write(load_cached_review_json(symbol))
 
 
 if __name__ == "__main__":
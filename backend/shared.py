@@ -1,17 +1,113 @@
 """Shared utilities for backend scripts."""
 from __future__ import annotations
 
+import json
 import os
 import math
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson as _orjson  # 任意依存: C 実装の JSON パーサー（無ければ標準 json で読む）
+except ImportError:
+    _orjson = None
+
 
 def atomic_write_text(path: Path, text: str, encoding: str = "utf-8") -> None:
-    """一時ファイル + rename で書き込み、クラッシュ時のファイル破損（途中書き）を防ぐ。"""
+    """一時ファイル + rename で書き込み、クラッシュ時のファイル破損（途中書き）を防ぐ。
+
+    一時ファイル名にプロセス ID とスレッド ID を含め、同じファイルへの同時書き込み
+    （チャットサーバーのスレッド間など）が互いの一時ファイルを上書きしないようにする。
+    失敗時は一時ファイルを残さない。
+    """
     path = Path(path)
-    tmp = path.with_name(path.name + ".tmp")
-    tmp.write_text(text, encoding=encoding)
-    os.replace(tmp, path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        tmp.write_text(text, encoding=encoding)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def utc_now_iso() -> str:
+    """現在の UTC 時刻を秒精度の ISO 8601（例: 2026-01-02T03:04:05Z）で返す。DB の更新時刻の共通書式。"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class RateLimiter:
+    """スレッド間で共有するトークンバケット。
+
+    burst 回までは待たずに通し、それを超えると毎秒 rate 回のペースに均す。
+    枠はロック内で予約し、待ち（sleep）はロックの外で行うので、並行ワーカーが
+    互いの待ちに巻き込まれて直列になることはない。
+    """
+
+    __slots__ = ("rate", "burst", "_tokens", "_updated", "_lock")
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# 銘柄ごとの Yahoo 問い合わせ（並行ワーカーから呼ばれる）の共通ペース。数銘柄の更新は
+# 待たずに通し、保有銘柄が多いときだけレート制限（429）に当たらないよう均す。
+yahoo_limiter = RateLimiter(rate=4.0, burst=8)
+
+
+def loads_json(data: bytes | str):
+    """JSON を解析する。orjson があれば C 実装で読み、無ければ標準 json で読む。
+
+    orjson は NaN / Infinity（json.dumps の既定出力）や BOM を受け付けないため、
+    その場合は標準 json で読み直す（bytes を渡せば BOM 付き UTF-8 も判別される）。
+    """
+    if _orjson is not None:
+        try:
+            return _orjson.loads(data)
+        except _orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps_json(value, *, indent: bool = False) -> str:
+    """JSON 文字列にする（非 ASCII はそのまま）。orjson があれば C 実装で書き出す。
+
+    orjson は NaN / Infinity を null として書く。orjson が扱えない値（str 以外のキー等）は標準 json に任せる。
+    """
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(value, option=_orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False, indent=2 if indent else None)
+
+
+def dumps_json_bytes(value) -> bytes:
+    """UTF-8 の JSON バイト列にする。標準出力へそのまま書く用途で、orjson の出力を str に戻さずに済む。"""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(value)
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
 
 
 FX_TICKERS = {
@@ -52,6 +148,19 @@ def to_float(value) -> float | None:
         return None
 
 
+def first_positive(*values) -> float | None:
+    """先頭から順に見て、最初の有限かつ正の値を float で返す（無ければ None）。
+
+    Yahoo の価格項目は欠損が None / NaN / 0 のいずれでも来るため、`a or b` だと
+    NaN（真と評価される）をそのまま採用してしまう。価格の候補選びはこちらを使う。
+    """
+    for value in values:
+        numeric = to_float(value)
+        if numeric is not None and numeric > 0:
+            return numeric
+    return None
+
+
 def get_yf_price(ticker: str, *, require_currency: bool = False) -> tuple[float, float, str]:
     """Return (price, previous_close, currency) for any ticker.
 
@@ -62,8 +171,8 @@ def get_yf_price(ticker: str, *, require_currency: bool = False) -> tuple[float,
 
     stock = yf.Ticker(ticker)
     info = stock.fast_info
-    price = info.get("lastPrice") or info.get("regularMarketPrice") or info.get("previousClose")
-    previous_close = info.get("previousClose")
+    price = first_positive(info.get("lastPrice"), info.get("regularMarketPrice"), info.get("previousClose"))
+    previous_close = first_positive(info.get("previousClose"))
     raw_currency = info.get("currency")
     if not raw_currency:
         if require_currency:
@@ -85,13 +194,24 @@ def get_yf_price(ticker: str, *, require_currency: bool = False) -> tuple[float,
     return float(price), float(previous_close), currency
 
 
-def convert_to_jpy(price: float, currency: str) -> tuple[float, float]:
-    """Convert price from currency to JPY. Returns (price_jpy, fx_rate)."""
+@lru_cache(maxsize=None)
+def get_fx_rate(currency: str) -> float:
+    """通貨の現在の対円レート。
+
+    スクリプトは操作ごとに起動されるため、1回の実行内で同じ通貨のレートを銘柄ごとに
+    Yahoo へ取り直さないよう結果を覚えておく（失敗は覚えないので次の呼び出しで再試行する）。
+    """
     normalized = (currency or "JPY").upper()
     if normalized == "JPY":
-        return float(price), 1.0
+        return 1.0
     fx_ticker = FX_TICKERS.get(normalized)
     if not fx_ticker:
         raise ValueError(f"Unsupported currency: {normalized}")
     fx_price, _, _ = get_yf_price(fx_ticker)
-    return float(price) * fx_price, fx_price
+    return fx_price
+
+
+def convert_to_jpy(price: float, currency: str) -> tuple[float, float]:
+    """Convert price from currency to JPY. Returns (price_jpy, fx_rate)."""
+    fx_rate = get_fx_rate((currency or "JPY").upper())
+    return float(price) * fx_rate, fx_rate
@@ -29,13 +29,15 @@ def normalize_ticker(code: object) -> str:
 
 def download_jpx_dataframe() -> pd.DataFrame:
     last_error = None
-    for url in JPX_URLS:
-        try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            return pd.read_excel(BytesIO(response.content))
-        except Exception as exc:  # pragma: no cover - network varies
-            last_error = exc
+    # 候補 URL は同じホストなので、フォールバック時も接続（TLS）を使い回す
+    with requests.Session() as session:
+        for url in JPX_URLS:
+            try:
+                response = session.get(url, timeout=30)
+                response.raise_for_status()
+                return pd.read_excel(BytesIO(response.content))
+            except Exception as exc:  # pragma: no cover - network varies
+                last_error = exc
     raise RuntimeError(f"JPX download failed: {last_error}")
 
 
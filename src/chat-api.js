@@ -92,16 +92,21 @@ export async function streamChat(sessionId, messages, {
   const reader = res.body.getReader();
   const decoder = new TextDecoder();
   let buffer = "";
-  while (true) {
-    const { done, value } = await reader.read();
-    if (done) break;
-    buffer += decoder.decode(value, { stream: true });
-    const events = buffer.split("\n\n");
-    buffer = events.pop() ?? "";
-    events.forEach(dispatchLines);
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop() ?? "";
+      events.forEach(dispatchLines);
+    }
+    // 最終イベントの後ろに空行が無いままストリームが終わるケースを取りこぼさない
+    if (buffer.trim()) dispatchLines(buffer);
+  } finally {
+    // 完了・エラー・途中切断のいずれでも、生成中の表示（思考中…など）を閉じさせる
+    if (onActivity) onActivity({ type: "stream_end" });
   }
-  // 最終イベントの後ろに空行が無いままストリームが終わるケースを取りこぼさない
-  if (buffer.trim()) dispatchLines(buffer);
 }
 
 const TOOL_LABELS = {
@@ -110,10 +115,24 @@ const TOOL_LABELS = {
   stock_snapshot: "銘柄指標"
 };
 
-// エージェントの活動イベント（tool_call / tool_result / thinking / turn_reset）を
+// エージェントの活動イベント（tool_call / tool_result / thinking / turn_reset / stream_end）を
 // メッセージ内の活動領域に描画するハンドラーを作る。renderer-chat / renderer-stock-chat 共用。
 export function createActivityRenderer(activityEl, { onTextReset, onUpdate, onModel } = {}) {
-  let lastToolLine = null;
+  // 結果待ちのツール行。1ターンの複数ツールは並行に実行され、結果は呼び出し順に届く
+  const pendingToolLines = [];
+  // 生成中の思考ブロック（thinking_delta で追記し、ターン末の thinking かストリーム終了で確定する）
+  let liveThinking = null;
+  const createThinking = (label) => {
+    const details = document.createElement("details");
+    details.className = "chat-thinking";
+    const summary = document.createElement("summary");
+    summary.textContent = label;
+    const body = document.createElement("div");
+    body.className = "chat-thinking-body";
+    details.append(summary, body);
+    activityEl.appendChild(details);
+    return { summary, body };
+  };
   return (evt) => {
     if (!evt || !activityEl) return;
     if (evt.type === "model") {
@@ -125,22 +144,28 @@ export function createActivityRenderer(activityEl, { onTextReset, onUpdate, onMo
       const arg = evt.args?.query || evt.args?.ticker || "";
       line.textContent = `🔍 ${label}${arg ? `: ${arg}` : ""}`;
       activityEl.appendChild(line);
-      lastToolLine = line;
+      pendingToolLines.push(line);
     } else if (evt.type === "tool_result") {
-      if (lastToolLine) {
-        lastToolLine.textContent += evt.count != null ? ` → ${evt.count}件` : " → 取得";
-        lastToolLine = null;
+      const line = pendingToolLines.shift();
+      if (line) {
+        line.textContent += evt.count != null ? ` → ${evt.count}件` : " → 取得";
       }
+    } else if (evt.type === "thinking_delta") {
+      if (!liveThinking) liveThinking = createThinking("思考中…");
+      liveThinking.body.append(evt.content || "");
     } else if (evt.type === "thinking") {
-      const details = document.createElement("details");
-      details.className = "chat-thinking";
-      const summary = document.createElement("summary");
-      summary.textContent = "思考";
-      const body = document.createElement("div");
-      body.className = "chat-thinking-body";
-      body.textContent = evt.content || "";
-      details.append(summary, body);
-      activityEl.appendChild(details);
+      const block = liveThinking || createThinking("思考");
+      liveThinking = null;
+      block.summary.textContent = "思考";
+      // 断片ごとのテキストノードを1つにまとめ直す
+      block.body.textContent = evt.content || "";
+    } else if (evt.type === "stream_end") {
+      // thinking が届かないまま終わった（エラー・切断）ときは、届いた分で確定する
+      if (liveThinking) {
+        liveThinking.summary.textContent = "思考";
+        liveThinking.body.normalize();
+        liveThinking = null;
+      }
     } else if (evt.type === "turn_reset") {
       if (onTextReset) onTextReset();
     }
@@ -40,6 +40,11 @@ const CHAT_SIDEBAR_DEFAULT_WIDTH = 220;
 const CHAT_SIDEBAR_MIN_WIDTH = 180;
 const CHAT_SIDEBAR_MAX_WIDTH = 440;
 const CTX_OPTIONS = [4096, 8192, 16384, 32768, 65536];
+const CACHE_TYPE_OPTIONS = [
+  { value: "f16", label: "f16（標準）" },
+  { value: "q8_0", label: "q8_0（省メモリ）" },
+  { value: "q4_0", label: "q4_0（最小メモリ）" },
+];
 
 let treeDragState = null;
 
@@ -926,7 +931,8 @@ async function regenerateFromUserMessage(messageId) {
 
   const targetIndex = chatHistory.findIndex(m => m.id === messageId);
   if (targetIndex === -1 || chatHistory[targetIndex].role !== "user") return;
-  chatHistory = chatHistory.slice(0, targetIndex + 1);
+  // 再生成する発言より後ろは配列をコピーせずその場で切り詰める
+  chatHistory.length = targetIndex + 1;
 
   streaming = true;
   setInputEnabled(false);
@@ -1147,7 +1153,27 @@ async function renderModelModal() {
   ctxFieldLabel.textContent = "コンテキスト長：";
   ctxField.append(ctxFieldLabel, ctxSelect);
 
-  head.append(state, ctxField);
+  const cacheSelect = document.createElement("select");
+  cacheSelect.className = "chat-role-select chat-role-ctx";
+  CACHE_TYPE_OPTIONS.forEach(({ value, label }) => {
+    const option = document.createElement("option");
+    option.value = value;
+    option.textContent = label;
+    if (value === (status.cache_type || "f16")) option.selected = true;
+    cacheSelect.appendChild(option);
+  });
+  cacheSelect.addEventListener("change", () => {
+    api("PUT", "/llama/settings", { cache_type: cacheSelect.value }).catch(() => {});
+  });
+
+  const cacheField = document.createElement("label");
+  cacheField.className = "chat-model-context";
+  cacheField.title = "会話の途中経過（KVキャッシュ）を保持する精度です。q8_0 にするとメモリ使用量がほぼ半分になり、長いコンテキストでも速度が落ちにくくなります。次回のロードから反映されます。";
+  const cacheFieldLabel = document.createElement("span");
+  cacheFieldLabel.textContent = "KVキャッシュ：";
+  cacheField.append(cacheFieldLabel, cacheSelect);
+
+  head.append(state, ctxField, cacheField);
 
   if (status.ready) {
     const stopBtn = document.createElement("button");
@@ -1175,7 +1201,7 @@ async function renderModelModal() {
   chatModelList.appendChild(head);
 
   // モデル一覧: クリックでロード
-  models.forEach(({ name, path, relative_path }) => {
+  models.forEach(({ name, path, relative_path, quant, size_bytes }) => {
     const isCurrent = path === status.model_path;
     const isRunning = isCurrent && status.ready;
 
@@ -1186,10 +1212,16 @@ async function renderModelModal() {
     label.className = "chat-model-item-name";
     label.textContent = name;
     item.title = relative_path || name;
+    // 量子化タグとファイルサイズ: デコード速度はほぼ重みの読み出し量で決まるため、選ぶ目安として出す
+    const meta = document.createElement("span");
+    meta.className = "chat-model-item-meta";
+    meta.textContent = [quant, size_bytes ? `${(size_bytes / 1024 ** 3).toFixed(1)} GB` : ""]
+      .filter(Boolean)
+      .join(" · ");
     const badge = document.createElement("span");
     badge.className = "chat-model-item-state";
     badge.textContent = isRunning ? "稼働中" : "ロード";
-    item.append(label, badge);
+    item.append(label, meta, badge);
 
     item.addEventListener("click", async () => {
       if (loadingModel) return;
@@ -1207,6 +1239,7 @@ async function renderModelModal() {
         await api("POST", "/llama/start", {
           model_path: path,
           ctx_size: Number(ctxSelect.value) || null,
+          cache_type: cacheSelect.value,
         });
         setAppStatus(selectedName + " をロードしました。", "success");
       } catch (err) {